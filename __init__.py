@@ -1,5 +1,8 @@
 
 from .phonetic_transcriber import *
 from .phonetic_converter import *
+from .incremental import IncrementalTranscriber
+from .async_transcriber import AsyncPhoneticTranscriber
 
 from . import server
+from . import client
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from .phonetic_transcriber import PhoneticTranscriber, paragraph_split_re, whitespace_re
+except ImportError:
+    from phonetic_transcriber import PhoneticTranscriber, paragraph_split_re, whitespace_re
+
+
+# asyncio front end for PhoneticTranscriber: calls made within `window` seconds of each other are collected into one
+# batch, equal words (and text chunks) are transcribed once and the batch runs in executor, off the event loop
+
+
+class AsyncPhoneticTranscriber:
+
+    def __init__(self, transcriber=None, window=0.002, max_batch=512, executor=None, **kwargs):
+        # kwargs are passed to PhoneticTranscriber when transcriber is not given
+        self.transcriber = transcriber if transcriber is not None else PhoneticTranscriber(**kwargs)
+        self.window = window
+        self.max_batch = max_batch
+        self.own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix='async-transcriber')
+        self.pending = {}       # key -> future of the batch being collected
+        self.timer = None
+        self.running = set()
+        self.batches = 0
+        self.items = 0
+        self.deduplicated = 0
+
+    def submit(self, key):
+        future = self.pending.get(key)
+        if future is not None:
+            self.deduplicated += 1
+        else:
+            loop = asyncio.get_running_loop()
+            future = self.pending[key] = loop.create_future()
+            if len(self.pending) >= self.max_batch:
+                self.flush()
+            elif self.timer is None:
+                self.timer = loop.call_later(self.window, self.flush)
+        # shielded, so a cancelled caller does not cancel result shared with other callers
+        return asyncio.shield(future)
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, {}
+        task = asyncio.ensure_future(self.run_batch(batch))
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+
+    def transcribe_batch(self, keys):
+        transcriber = self.transcriber
+        results = []
+        for key in keys:
+            try:
+                if key[0] == 'word':
+                    results.append((True, transcriber.transcribe(key[1], key[2])))
+                else:
+                    results.append((True, transcriber.transcribeChunk(*key[1:])))
+            except Exception as e:
+                results.append((False, e))
+        return results
+
+    async def run_batch(self, batch):
+        self.batches += 1
+        self.items += len(batch)
+        keys = list(batch)
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self.transcribe_batch, keys)
+        except BaseException as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e if isinstance(e, Exception) else RuntimeError('transcription batch cancelled'))
+            raise
+        for key, (ok, result) in zip(keys, results):
+            future = batch[key]
+            if future.done():
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+    async def transcribe(self, word, sep=None):
+        return await self.submit(('word', word, sep))
+
+    async def transcribe_many(self, words, sep=None):
+        return list(await asyncio.gather(*(self.submit(('word', word, sep)) for word in words)))
+
+    async def transcribe_text(self, text, preserve_unknown=True, sep='', unknown_sep=''):
+        # same result as PhoneticTranscriber.transcribeText, chunks are batched and deduplicated across callers
+        paragraphs = [whitespace_re.sub(' ', paragraph).split(' ') for paragraph in paragraph_split_re.split(text)]
+        results = await asyncio.gather(*(self.submit(('chunk', chunk, preserve_unknown, sep, unknown_sep))
+                                         for chunks in paragraphs for chunk in chunks))
+        results = iter(results)
+        transcribed = []
+        for chunks in paragraphs:
+            tokens = []
+            for _ in chunks:
+                tokens += next(results)
+            transcribed.append(tokens if sep is True else ' '.join(tokens))
+        if sep is True:
+            return transcribed
+        return '\n'.join(transcribed)
+
+    async def drain(self):
+        # waits until all submitted work is done
+        self.flush()
+        while self.running:
+            await asyncio.gather(*self.running, return_exceptions=True)
+
+    async def close(self):
+        await self.drain()
+        if self.own_executor:
+            self.executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+
+import sys, re, gc, json, time, math, random, platform, tracemalloc
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+try:
+    from .phonetic_transcriber import PhoneticTranscriberData, PhoneticTranscriber, clean_text, jsdict
+    from . import phonetic_converter
+except ImportError:
+    from phonetic_transcriber import PhoneticTranscriberData, PhoneticTranscriber, clean_text, jsdict
+    import phonetic_converter
+
+
+# Micro-benchmarks of the transcription engine on a deterministic synthetic corpus.
+#
+#   python benchmark.py --save baseline.json          # record baseline
+#   python benchmark.py --compare baseline.json       # exit code 1 if any benchmark is slower than allowed
+#
+# Timings are the best of --repeat runs, each run is at least --min-time seconds long.
+
+
+encoders = ['AlphaNumericSimplifiedCharacterConverter', 'AlphaNumericCharacterConverter', 'AlphabeticCharacterConverter',
+            'IPASimplifiedCharacterConverter', 'IPACharacterConverter']
+
+
+def make_corpus(data, seed=0, words=2000, paragraphs=50, exception_share=0.2):
+    # Latvian-like words from metarule alphabets: [prefix] (onset vowel coda)+ ending, mixed with exception words
+    rnd = random.Random(seed)
+    metarules = data.metarules
+    onsets = sorted(metarules['i'])
+    vowels = sorted(metarules['a'])
+    codas = sorted(set(metarules['d']) | {''})
+    endings = sorted(set(metarules['r']) | set(metarules['o']) | set(metarules['p']))
+    prefixes = sorted(metarules['n'])
+    exceptions = sorted(data.exceptions)
+
+    def make_word():
+        if exceptions and rnd.random() < exception_share:
+            return rnd.choice(exceptions)
+        word = rnd.choice(prefixes) if rnd.random() < 0.15 else ''
+        for _ in range(rnd.choice((1, 1, 2, 2, 2, 3))):
+            word += rnd.choice(onsets) + rnd.choice(vowels) + (rnd.choice(codas) if rnd.random() < 0.3 else '')
+        return word + rnd.choice(endings)
+
+    def make_paragraph():
+        sentences = []
+        for _ in range(rnd.randint(1, 5)):
+            tokens = [make_word() for _ in range(rnd.randint(3, 15))]
+            tokens[0] = tokens[0].capitalize()
+            if rnd.random() < 0.3:
+                tokens.insert(rnd.randrange(len(tokens)), str(rnd.randint(1, 2000)))
+            if rnd.random() < 0.3:
+                i = rnd.randrange(len(tokens))
+                tokens[i] += ','
+            sentences.append(' '.join(tokens) + rnd.choice('..!?'))
+        return ' '.join(sentences)
+
+    return jsdict(words=[make_word() for _ in range(words)], paragraphs=[make_paragraph() for _ in range(paragraphs)])
+
+
+benchmarks = []
+
+
+def benchmark(name):
+    # registers function(context) returning (callable, operations per call)
+    def register(func):
+        benchmarks.append((name, func))
+        return func
+    return register
+
+
+@benchmark('data_loading')
+def bench_data_loading(ctx):
+    return PhoneticTranscriberData, 1
+
+
+@benchmark('construction')
+def bench_construction(ctx):
+    encoder = phonetic_converter.IPACharacterConverter()
+    return lambda: PhoneticTranscriber(sep=' ', encoder=encoder, data=ctx.data), 1
+
+
+@benchmark('clean_text')
+def bench_clean_text(ctx):
+    paragraphs = ctx.corpus.paragraphs
+    return lambda: [clean_text(paragraph) for paragraph in paragraphs], len(paragraphs)
+
+
+@benchmark('split_unknown')
+def bench_split_unknown(ctx):
+    transcriber = ctx.transcriber
+    chunks = [chunk for paragraph in ctx.paragraphs for chunk in paragraph.split(' ')]
+    return lambda: [transcriber.split_unknown(chunk) for chunk in chunks], len(chunks)
+
+
+@benchmark('test_rule')
+def bench_test_rule(ctx):
+    # every rule that is tried at every position of every word
+    transcriber = ctx.transcriber
+    calls = [(rule, word, p) for word in ctx.rule_words[:300] for p in range(len(word)) for rule in transcriber.rules.get(word[p], ())]
+    test_rule = transcriber.test_rule
+    return lambda: [test_rule(rule, word, p) for rule, word, p in calls], len(calls)
+
+
+@benchmark('rules_transcribe')
+def bench_rules_transcribe(ctx):
+    transcriber = ctx.transcriber
+    words = ctx.rule_words
+    return lambda: [transcriber.rules_transcribe(word) for word in words], len(words)
+
+
+@benchmark('rules_transcribe[inflected]')
+def bench_rules_transcribe_inflected(ctx):
+    transcriber = ctx.transcriber
+    words = ctx.inflected
+    return lambda: [transcriber.rules_transcribe(word) for word in words], len(words)
+
+
+@benchmark('rules_transcribe_many[inflected]')
+def bench_rules_transcribe_many(ctx):
+    transcriber = ctx.transcriber
+    words = ctx.inflected
+    return lambda: transcriber.rules_transcribe_many(words), len(words)
+
+
+@benchmark('rules_transcribe_batch[numpy]')
+def bench_rules_transcribe_numpy(ctx):
+    try:
+        from .numpy_engine import NumpyRulesEngine
+    except ImportError:
+        from numpy_engine import NumpyRulesEngine
+    engine = NumpyRulesEngine(ctx.transcriber)
+    words = ctx.rule_words
+    return lambda: engine.rules_transcribe_batch(words), len(words)
+
+
+# columnar engine pays per lockstep step, it only overtakes rules_transcribe on large batches (tens of thousands of words)
+
+@benchmark('rules_transcribe[bulk]')
+def bench_rules_transcribe_bulk(ctx):
+    transcriber = ctx.transcriber
+    words = ctx.bulk_words
+    return lambda: [transcriber.rules_transcribe(word) for word in words], len(words)
+
+
+@benchmark('rules_transcribe_batch[numpy,bulk]')
+def bench_rules_transcribe_numpy_bulk(ctx):
+    try:
+        from .numpy_engine import NumpyRulesEngine
+    except ImportError:
+        from numpy_engine import NumpyRulesEngine
+    engine = NumpyRulesEngine(ctx.transcriber)
+    words = ctx.bulk_words
+    return lambda: engine.rules_transcribe_batch(words), len(words)
+
+
+@benchmark('transcribe[none]')
+def bench_transcribe(ctx):
+    transcriber = PhoneticTranscriber(sep=' ', data=ctx.data)
+    words = ctx.words
+    return lambda: [transcriber.transcribe(word) for word in words], len(words)
+
+
+def bench_transcribe_encoder(encoder):
+    def bench(ctx):
+        transcriber = PhoneticTranscriber(sep=' ', encoder=getattr(phonetic_converter, encoder)(), data=ctx.data)
+        words = ctx.words
+        return lambda: [transcriber.transcribe(word) for word in words], len(words)
+    return bench
+
+
+for encoder in encoders:
+    benchmark(f'transcribe[{encoder}]')(bench_transcribe_encoder(encoder))
+
+
+def bench_transcribe_parallel(threads):
+    # scaling of one shared transcriber over thread pool, multi-core only on free-threaded builds
+    def bench(ctx):
+        executor = ctx.resources.enter_context(ThreadPoolExecutor(threads))
+        transcriber = ctx.transcriber
+        words = ctx.words
+        chunk_size = max(1, len(words) // (threads * 4))
+        return lambda: transcriber.transcribe_parallel(words, executor=executor, chunk_size=chunk_size), len(words)
+    return bench
+
+
+for threads in (1, 2, 4, 8):
+    benchmark(f'transcribe_parallel[threads={threads}]')(bench_transcribe_parallel(threads))
+
+
+@benchmark('transcribeText')
+def bench_transcribe_text(ctx):
+    transcriber = ctx.transcriber
+    paragraphs = ctx.paragraphs
+    return lambda: [transcriber.transcribeText(paragraph) for paragraph in paragraphs], len(paragraphs)
+
+
+def make_context(seed=0, words=2000, paragraphs=50, bulk_words=32000):
+    data = PhoneticTranscriberData()
+    corpus = make_corpus(data, seed=seed, words=words, paragraphs=paragraphs)
+    transcriber = PhoneticTranscriber(sep=' ', encoder=phonetic_converter.IPACharacterConverter(), data=data)
+    words = [clean_text(word) for word in corpus.words]
+    rule_words = [word for word in words if word not in data.exceptions]
+    # sorted lexicon of inflected forms: corpus words with their ending replaced by every noun ending
+    endings = sorted(set(data.metarules['r']) | set(data.metarules['o']) | set(data.metarules['p']))
+    inflected = sorted({word[:-2] + ending for word in rule_words[:200] for ending in endings})
+    bulk = make_corpus(data, seed=seed + 1, words=bulk_words, paragraphs=0, exception_share=0)
+    return jsdict(data=data, corpus=corpus, transcriber=transcriber, words=words, rule_words=rule_words, inflected=inflected,
+                  bulk_words=[clean_text(word) for word in bulk.words],
+                  paragraphs=[clean_text(paragraph) for paragraph in corpus.paragraphs])
+
+
+def measure(func, ops, repeat=5, min_time=0.2, memory=True):
+    # returns ops/sec of the best run and peak memory allocated during one call
+    func()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    loops = max(1, math.ceil(min_time / elapsed)) if elapsed > 0 else 1000
+    best = None
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(loops):
+                func()
+            elapsed = (time.perf_counter() - start) / loops
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    result = jsdict(ops=ops, ops_per_sec=ops / best if best else float('inf'), us_per_op=best / ops * 1e6)
+    if memory:
+        tracemalloc.start()
+        try:
+            func()
+            result.peak_memory = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def run(pattern=None, seed=0, words=2000, paragraphs=50, bulk_words=32000, repeat=5, min_time=0.2, memory=True, report=None):
+    ctx = make_context(seed=seed, words=words, paragraphs=paragraphs, bulk_words=bulk_words)
+    results = {}
+    for name, func in benchmarks:
+        if pattern and not re.search(pattern, name):
+            continue
+        # resources a benchmark enters (e.g. thread pools) are released when it is measured
+        with ExitStack() as ctx.resources:
+            try:
+                bench = func(ctx)
+            except ImportError:
+                # optional dependency missing, e.g. numpy
+                continue
+            results[name] = measure(*bench, repeat=repeat, min_time=min_time, memory=memory)
+        if report:
+            report(name, results[name])
+    return jsdict(meta=jsdict(date=datetime.now(timezone.utc).isoformat(timespec='seconds'), python=platform.python_version(),
+                              implementation=platform.python_implementation(), platform=platform.platform(),
+                              gil=getattr(sys, '_is_gil_enabled', lambda: True)(),
+                              data_version=ctx.data.version, seed=seed, words=words, paragraphs=paragraphs, bulk_words=bulk_words),
+                  results=results)
+
+
+def compare(results, baseline, thresholds, default_threshold=0.1):
+    # returns list of (name, baseline ops/sec, ops/sec, change) for benchmarks slower than allowed threshold
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        change = result['ops_per_sec'] / base['ops_per_sec'] - 1
+        if change < -thresholds.get(name, default_threshold):
+            regressions.append((name, base['ops_per_sec'], result['ops_per_sec'], change))
+    return regressions
+
+
+def format_memory(size):
+    if size is None:
+        return '-'
+    return f'{size / 1024:.1f} KiB'
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--filter', '-k', metavar='REGEX', type=str, help='run benchmarks with matching names only')
+    parser.add_argument('--list', '-l', action='store_true', help='list benchmarks')
+    parser.add_argument('--seed', metavar='N', type=int, default=0, help='synthetic corpus seed')
+    parser.add_argument('--words', metavar='N', type=int, default=2000, help='words in synthetic corpus')
+    parser.add_argument('--bulk-words', metavar='N', type=int, default=32000, help='words in bulk batch benchmarks')
+    parser.add_argument('--paragraphs', metavar='N', type=int, default=50, help='paragraphs in synthetic corpus')
+    parser.add_argument('--repeat', '-n', metavar='N', type=int, default=5, help='timed runs per benchmark, best is reported')
+    parser.add_argument('--min-time', metavar='SECONDS', type=float, default=0.2, help='minimum duration of one timed run')
+    parser.add_argument('--no-memory', action='store_true', help='skip tracemalloc peak memory measurement')
+    parser.add_argument('--save', '-o', metavar='FILE', type=str, help='save results as json baseline')
+    parser.add_argument('--compare', '-c', metavar='FILE', type=str, help='compare with json baseline, exit with 1 on regression')
+    parser.add_argument('--threshold', '-t', metavar='[NAME=]FRACTION', action='append', default=[],
+                        help='allowed slowdown, e.g. 0.1 for 10%%, default 0.1; NAME=FRACTION sets it for one benchmark')
+
+    args = parser.parse_args()
+
+    if args.list:
+        for name, _ in benchmarks:
+            print(name)
+        sys.exit(0)
+
+    default_threshold = 0.1
+    thresholds = {}
+    for threshold in args.threshold:
+        name, sep, value = threshold.rpartition('=')
+        if sep:
+            thresholds[name] = float(value)
+        else:
+            default_threshold = float(value)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)['results']
+
+    def report(name, result):
+        line = f'{name:<50} {result.ops_per_sec:>14,.1f} ops/s {result.us_per_op:>12.2f} us/op {format_memory(result.peak_memory):>14}'
+        if baseline and name in baseline:
+            line += f' {result.ops_per_sec / baseline[name]["ops_per_sec"] - 1:>+8.1%}'
+        print(line, flush=True)
+
+    results = run(args.filter, seed=args.seed, words=args.words, paragraphs=args.paragraphs, bulk_words=args.bulk_words, repeat=args.repeat,
+                  min_time=args.min_time, memory=not args.no_memory, report=report)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results.results, baseline, thresholds, default_threshold)
+        for name, base, current, change in regressions:
+            print(f'REGRESSION {name}: {base:,.1f} -> {current:,.1f} ops/s ({change:+.1%})', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
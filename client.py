@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import json, socket, time, gzip, queue
+import http.client
+from urllib.parse import urlencode
+
+
+# Client for the transcription server (server.py) with a pool of persistent connections over TCP or unix domain socket
+
+
+class TranscriberClientError(Exception):
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+            sock.settimeout(self.timeout)
+        sock.connect(self.unix_path)
+        self.sock = sock
+
+
+class TranscriberClient:
+
+    # thread safe, each call takes a connection from the pool for the duration of the request
+
+    retry_statuses = (502, 503, 504)
+
+    def __init__(self, address='localhost:8080', pool_size=4, timeout=10, retries=2, retry_delay=0.1, compress=True):
+        # address: [http://]HOST:PORT or unix:PATH
+        if address.startswith('unix:'):
+            self.unix_path = address[5:]
+            self.host, self.port = None, None
+        else:
+            if address.startswith('http://'):
+                address = address[7:].rstrip('/')
+            host, _, port = address.rpartition(':')
+            self.unix_path = None
+            self.host, self.port = host or 'localhost', int(port or 8080)
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.compress = compress
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+        self.closed = False
+
+    def new_connection(self):
+        if self.unix_path:
+            return UnixHTTPConnection(self.unix_path, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self):
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            return self.new_connection()
+
+    def release(self, connection):
+        if self.closed:
+            connection.close()
+            return
+        try:
+            self.pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def request(self, method, path, params=None, body=None, headers=None):
+        # returns decoded json response; retries on connection errors and overload responses
+        target = path + ('?' + urlencode(params) if params else '')
+        headers = dict(headers or {})
+        headers['Accept'] = 'application/json'
+        if self.compress:
+            headers['Accept-Encoding'] = 'gzip'
+        attempt = 0
+        while True:
+            connection = self.acquire()
+            try:
+                connection.request(method, target, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (ConnectionError, http.client.HTTPException, socket.timeout, OSError) as e:
+                # pooled connection may have been closed by server after keep-alive timeout
+                connection.close()
+                if attempt >= self.retries:
+                    raise TranscriberClientError(f'request failed: {e}')
+                attempt += 1
+                continue
+            if response.will_close:
+                connection.close()
+            else:
+                self.release(connection)
+            if response.status in self.retry_statuses and attempt < self.retries:
+                attempt += 1
+                retry_after = response.getheader('Retry-After')
+                time.sleep(min(float(retry_after), self.timeout) if retry_after and retry_after.isdigit() else self.retry_delay * attempt)
+                continue
+            if response.status != 200:
+                raise TranscriberClientError(f'{method} {target} failed: {response.status} {response.reason}', response.status)
+            if response.getheader('Content-Encoding') == 'gzip':
+                data = gzip.decompress(data)
+            return json.loads(data.decode('utf8'))
+
+    @staticmethod
+    def sep_params(sep, unknown_sep=None, preserve_unknown=True):
+        params = {'psep': 'json' if sep is True else sep, 'fmt': 'json'}
+        if unknown_sep is not None:
+            params['usep'] = unknown_sep
+        if not preserve_unknown:
+            params['unknown'] = 'false'
+        return params
+
+    def transcribe(self, word, sep=' '):
+        # sep=True returns list of phonemes
+        params = self.sep_params(sep)
+        params['word'] = word
+        return self.request('GET', '/transcribe', params)
+
+    def transcribe_text(self, text, sep=' ', unknown_sep='', preserve_unknown=True):
+        return self.request('POST', '/transcribe', self.sep_params(sep, unknown_sep, preserve_unknown), body=text.encode('utf8'),
+                            headers={'Content-Type': 'text/plain; charset=utf-8'})
+
+    def transcribe_batch(self, words, sep=' ', batch_size=1000):
+        # transcribes list of words in batches of batch_size words per request
+        result = []
+        for i in range(0, len(words), batch_size):
+            body = json.dumps({'words': list(words[i:i+batch_size])}, ensure_ascii=False).encode('utf8')
+            result += self.request('POST', '/transcribe', self.sep_params(sep), body=body,
+                                   headers={'Content-Type': 'application/json; charset=utf-8'})
+        return result
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                self.pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--server', '-s', metavar='HOST:PORT', default='localhost:8080', help='server address [HOST]:PORT or unix:PATH')
+    parser.add_argument('--phrase', '-p', action='append', help='input phrase to transcribe')
+    parser.add_argument('--phoneme-sep', '--psep', metavar='SEP', type=str, default=' ', help='phoneme separator')
+    parser.add_argument('word', nargs='*', type=str, help='input word to transcribe')
+
+    args = parser.parse_args()
+
+    with TranscriberClient(args.server) as client:
+        for phrase in args.phrase or []:
+            print(client.transcribe_text(phrase, sep=args.phoneme_sep))
+        if args.word:
+            for word, result in zip(args.word, client.transcribe_batch(args.word, sep=args.phoneme_sep)):
+                print(f'{word}\t{result}')
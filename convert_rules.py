@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-import re, json
+import os, re, sys, json
 # from collections import defaultdict
 
 
@@ -142,6 +142,259 @@ def convert_exceptions(filename, output_filename='exceptions.json', ensure_ascii
         json.dump(exceptions, f, indent=indent, ensure_ascii=ensure_ascii, sort_keys=True)
 
 
+# Static analysis of rules. Rules are tried in order among rules starting with the same char and the first matching
+# one is used, so a rule never fires if some earlier rule matches everywhere it matches; such shadowed rules can be
+# dropped without changing any transcription.
+#
+# Text and context of a rule are expanded into shapes: sequence of chars (None for any char, `?`) read away from the
+# rule position, plus what may follow: 'end' (`#`), 'nonempty' (`^`) or 'any'. Expansion takes every metarule
+# alternative, ignoring that matching picks the first one, so shapes describe a superset of texts the rule matches.
+# An earlier rule shadows it only if it is proven to match on every shape; whatever is not proven counts as not shadowed.
+
+MATCH, NO_MATCH, UNKNOWN = 'match', 'no match', 'unknown'
+
+
+def effective_subrules(subrules):
+    # subrules test_rule evaluates, matching stops after the first `#`, `^` or `*`
+    for n, subrule in enumerate(subrules):
+        if subrule.tag == 'm' and subrule.text in ('#', '^', '*'):
+            return subrules[:n + 1]
+    return subrules
+
+
+def expand_context(chars, subrules, metarules, reverse=False, limit=10000):
+    # returns list of (symbols, tail) or None if there are more than limit shapes; [] if context can never match
+    shapes = [(tuple(chars), None)]
+    for subrule in effective_subrules(subrules):
+        if subrule.tag not in ('u', 'm'):
+            return []
+        text = subrule.text
+        expanded = []
+        for symbols, tail in shapes:
+            if tail:
+                expanded.append((symbols, tail))
+            elif subrule.tag == 'u':
+                expanded.append((symbols + tuple(text[::-1] if reverse else text), None))
+            elif text == '?':
+                expanded.append((symbols + (None,), None))
+            elif text in ('#', '^', '*'):
+                expanded.append((symbols, {'#': 'end', '^': 'nonempty', '*': 'any'}[text]))
+            else:
+                for t in metarules[text]:
+                    expanded.append((symbols + tuple(t[::-1] if reverse else t), None))
+        if len(expanded) > limit:
+            return None
+        shapes = expanded
+    return [(symbols, tail or 'any') for symbols, tail in shapes]
+
+
+def match_status(shape, pos, chars):
+    symbols, tail = shape
+    unknown = False
+    for i, c in enumerate(chars):
+        q = pos + i
+        if q < len(symbols):
+            if symbols[q] is None:
+                unknown = True
+            elif symbols[q] != c:
+                return NO_MATCH
+        elif tail == 'end':
+            return NO_MATCH
+        else:
+            unknown = True
+    return UNKNOWN if unknown else MATCH
+
+
+def char_exists(shape, pos):
+    symbols, tail = shape
+    return pos < len(symbols) or (pos == len(symbols) and tail == 'nonempty')
+
+
+def always_matches(tokens, shape, metarules, reverse=False, pos=0):
+    # True if context given by tokens (subrules, text as 'u' subrule) matches every text of the shape
+    if not tokens:
+        return True
+    subrule, rest = tokens[0], tokens[1:]
+    text = subrule.text
+    if subrule.tag == 'u':
+        return match_status(shape, pos, text[::-1] if reverse else text) == MATCH and always_matches(rest, shape, metarules, reverse, pos + len(text))
+    if subrule.tag != 'm':
+        return False
+    if text == '?':
+        return char_exists(shape, pos) and always_matches(rest, shape, metarules, reverse, pos + 1)
+    if text == '#':
+        return pos == len(shape[0]) and shape[1] == 'end'
+    if text == '^':
+        return char_exists(shape, pos)
+    if text == '*':
+        return True
+    # first matching alternative is taken; every alternative that may be the first must lead to a match
+    for t in metarules[text]:
+        status = match_status(shape, pos, t[::-1] if reverse else t)
+        if status == NO_MATCH:
+            continue
+        if not always_matches(rest, shape, metarules, reverse, pos + len(t)):
+            return False
+        if status == MATCH:
+            return True
+    return False
+
+
+def is_unconditional(rule):
+    return all(subrule.tag == 'm' and subrule.text == '*' for subrule in effective_subrules(rule.left) + effective_subrules(rule.right))
+
+
+def check_subrules(rule, metarules):
+    # None if every evaluated subrule is valid; 'unreachable' if an unknown tag makes test_rule fail before any
+    # unknown metarule is reached, 'invalid' if an unknown metarule is reached first (test_rule raises KeyError)
+    for subrule in effective_subrules(rule.right) + effective_subrules(rule.left):
+        if subrule.tag not in ('u', 'm'):
+            return 'unreachable', f'unknown subrule tag {subrule.tag}'
+        if subrule.tag == 'm' and subrule.text not in ('?', '#', '^', '*') and subrule.text not in metarules:
+            return 'invalid', f'unknown metarule {subrule.text}'
+    return None
+
+
+def analyze_rules(rules, metarules, limit=10000):
+    # returns jsdict with lists of shadowed rules (index, shadowing rule index), unreachable rules (index, reason),
+    # invalid rules (index, reason; raise when evaluated, so they are kept), undecided rules (too many expansions)
+    # and unconditional rules (all contexts `*` or none), indexes into rules; kept lists unreachable rules pruning
+    # must keep, as the only rules of their first char (without any rule the char raises instead of being skipped)
+    result = jsdict(shadowed=[], unreachable=[], invalid=[], unconditional=[], undecided=[], kept=[])
+    by_char = {}
+    for i, rule in enumerate(rules):
+        by_char.setdefault(rule.text[0], []).append(i)
+        if is_unconditional(rule):
+            result.unconditional.append(i)
+    for indexes in by_char.values():
+        # rules that never match or raise can not shadow others
+        shadowers = []
+        unreachable = []
+        for i in indexes:
+            rule = rules[i]
+            problem = check_subrules(rule, metarules)
+            if problem:
+                result[problem[0]].append((i, problem[1]))
+                if problem[0] == 'unreachable':
+                    unreachable.append(i)
+                continue
+            right = expand_context(rule.text, rule.right, metarules, limit=limit)
+            left = expand_context('', rule.left, metarules, reverse=True, limit=limit)
+            if right is None or left is None:
+                result.undecided.append(i)
+                shadowers.append(i)
+                continue
+            for j in shadowers:
+                earlier = rules[j]
+                if all(always_matches([jsdict(tag='u', text=earlier.text)] + earlier.right, shape, metarules) for shape in right) and \
+                        all(always_matches(earlier.left, shape, metarules, reverse=True) for shape in left):
+                    result.shadowed.append((i, j))
+                    break
+            # a shadowed rule matches only where its shadower does, so it still proves shadowing soundly
+            shadowers.append(i)
+        if len(unreachable) == len(indexes):
+            result.kept.append(unreachable[-1])
+    result.shadowed.sort()
+    result.unreachable.sort()
+    result.invalid.sort()
+    result.kept.sort()
+    return result
+
+
+def rule_charset(rules, metarules):
+    # chars PhoneticTranscriber.rule_charset is built from, they decide which spans transcribeText leaves as unknown
+    chars = set()
+    for rule in rules:
+        chars.update(rule.text)
+        for subrule in rule.left + rule.right:
+            chars.update(subrule.text)
+    for texts in metarules.values():
+        for text in texts:
+            chars.update(text)
+    return chars - set('?#^*')
+
+
+def prune_rules(rules, analysis, metarules):
+    # rules without shadowed and unreachable ones, transcriptions stay identical; raises ValueError if removing them
+    # would change the rule charset
+    removed = set(i for i, _ in analysis.shadowed) | set(i for i, _ in analysis.unreachable)
+    removed -= set(analysis.kept)
+    pruned = [rule for i, rule in enumerate(rules) if i not in removed]
+    lost = rule_charset(rules, metarules) - rule_charset(pruned, metarules)
+    if lost:
+        raise ValueError(f'pruning would remove chars {"".join(sorted(lost))!r} from rule charset')
+    return pruned
+
+
+def format_rule(rule):
+    side = lambda subrules: ''.join(s.text if s.tag == 'u' or s.text in ('?', '#', '^', '*') else f'<{s.text}>' for s in subrules)
+    return f'{side(reversed(rule.left))}[{rule.text}]{side(rule.right)} -> {rule.repl}'
+
+
+def load_rules_json(filename):
+    with open(filename) as f:
+        data = json.load(f, object_hook=jsdict)
+    return data.rules, data.metarules
+
+
+def print_analysis(rules, analysis):
+    for i, j in analysis.shadowed:
+        print(f'shadowed     #{i:<4} {format_rule(rules[i])}    by #{j} {format_rule(rules[j])}')
+    for i, reason in analysis.unreachable:
+        kept = ', kept as the only rule of its char' if i in analysis.kept else ''
+        print(f'unreachable  #{i:<4} {format_rule(rules[i])}    {reason}{kept}')
+    for i, reason in analysis.invalid:
+        print(f'invalid      #{i:<4} {format_rule(rules[i])}    {reason}, kept')
+    for i in analysis.unconditional:
+        print(f'unconditional #{i:<3} {format_rule(rules[i])}')
+    for i in analysis.undecided:
+        print(f'undecided    #{i:<4} {format_rule(rules[i])}    too many context expansions')
+    print(f'{len(rules)} rules: {len(analysis.shadowed)} shadowed, {len(analysis.unreachable)} unreachable, '
+          f'{len(analysis.invalid)} invalid, {len(analysis.unconditional)} unconditional, {len(analysis.undecided)} undecided')
+
+
+def probe_words(rules, indexes, metarules, limit=20, filler='a'):
+    # words built from context shapes of given rules, so that verification exercises positions where they match
+    words = set()
+    for i in indexes:
+        rule = rules[i]
+        try:
+            right = expand_context(rule.text, rule.right, metarules, limit=limit) or [(tuple(rule.text), 'any')]
+            left = expand_context('', rule.left, metarules, reverse=True, limit=limit) or [((), 'any')]
+        except KeyError:
+            # unknown metarule
+            right, left = [(tuple(rule.text), 'any')], [((), 'any')]
+        for (left_symbols, left_tail) in left[:limit]:
+            for (right_symbols, right_tail) in right[:limit]:
+                word = ''.join(c or filler for c in reversed(left_symbols)) + ''.join(c or filler for c in right_symbols)
+                prefixes = [''] if left_tail == 'end' else [filler] if left_tail == 'nonempty' else ['', filler]
+                suffixes = [''] if right_tail == 'end' else [filler] if right_tail == 'nonempty' else ['', filler]
+                words.update(prefix + word + suffix for prefix in prefixes for suffix in suffixes)
+    return sorted(words)
+
+
+def verify_pruned(rules_filename, pruned_filename, words):
+    # transcribes words with both rule sets (rules only and as text, where unknown spans depend on the rule charset),
+    # returns jsdict with words transcribed differently and chars missing from or added to the pruned rule charset
+    try:
+        from .phonetic_transcriber import PhoneticTranscriberData, PhoneticTranscriber
+    except ImportError:
+        from phonetic_transcriber import PhoneticTranscriberData, PhoneticTranscriber
+    original = PhoneticTranscriber(sep='_', data=PhoneticTranscriberData(rules_filepath=rules_filename))
+    pruned = PhoneticTranscriber(sep='_', data=PhoneticTranscriberData(rules_filepath=pruned_filename))
+    def outputs(transcriber, word):
+        results = []
+        for func in (transcriber.rules_transcribe, transcriber.transcribeText):
+            try:
+                results.append(func(word))
+            except Exception as e:
+                results.append(repr(e))
+        return results
+
+    differences = [word for word in words if outputs(original, word) != outputs(pruned, word)]
+    return jsdict(words=differences, charset_missing=''.join(sorted(set(original.rule_charset) - set(pruned.rule_charset))),
+                  charset_added=''.join(sorted(set(pruned.rule_charset) - set(original.rule_charset))))
+
 
 if __name__ == '__main__':
 
@@ -154,6 +407,9 @@ if __name__ == '__main__':
     parser.add_argument('--out', '-o', default='rules.json', help='output json for combined rules and materules')
     parser.add_argument('--except-out', '--eo', default='exceptions.json', help='output json for exception db')
     parser.add_argument('--ensure-ascii', action='store_true', default=False, help='output ascii json')
+    parser.add_argument('--analyze', '-a', metavar='JSON', help='analyze rules json, report shadowed, unreachable and unconditional rules')
+    parser.add_argument('--prune-out', metavar='JSON', help='with --analyze, write rules json without shadowed and unreachable rules')
+    parser.add_argument('--verify', action='store_true', help='with --prune-out, check that exception and probe words transcribe identically with pruned rules, also as text, and that the rule charset is unchanged')
 
     args = parser.parse_args()
 
@@ -162,3 +418,32 @@ if __name__ == '__main__':
 
     if args.exceptdb and args.except_out:
         convert_exceptions(args.exceptdb, args.except_out, ensure_ascii=args.ensure_ascii)
+
+    if args.analyze:
+        rules, metarules = load_rules_json(args.analyze)
+        analysis = analyze_rules(rules, metarules)
+        print_analysis(rules, analysis)
+        if args.prune_out:
+            try:
+                pruned = prune_rules(rules, analysis, metarules)
+            except ValueError as e:
+                print(f'not pruning: {e}', file=sys.stderr)
+                sys.exit(1)
+            print(f'writing {args.prune_out}')
+            with open(args.prune_out, 'w') as f:
+                json.dump(dict(metarules=metarules, rules=pruned), f, indent=2, ensure_ascii=args.ensure_ascii, sort_keys=True)
+            if args.verify:
+                with open(os.path.join(os.path.dirname(os.path.abspath(args.analyze)), 'exceptions.json')) as f:
+                    words = list(json.load(f))
+                # plus words where removed rules and the rules shadowing them would match
+                removed = [i for i, _ in analysis.shadowed] + [j for _, j in analysis.shadowed] + [i for i, _ in analysis.unreachable]
+                words += probe_words(rules, removed, metarules)
+                # words with unknown chars too, transcribeText splits them off by the rule charset
+                words += [word + unknown for word in words[:100] for unknown in ('1', '-', 'ø')]
+                verification = verify_pruned(args.analyze, args.prune_out, words)
+                differences = verification.words
+                print(f'verified on {len(words)} words: {len(differences)} differences {differences[:10] if differences else ""}')
+                if verification.charset_missing or verification.charset_added:
+                    print(f'rule charset differs: missing {verification.charset_missing!r}, added {verification.charset_added!r}')
+                if differences or verification.charset_missing or verification.charset_added:
+                    sys.exit(1)
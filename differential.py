@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+import sys, json, random, logging, threading, importlib
+
+try:
+    from .phonetic_transcriber import PhoneticTranscriberData, PhoneticTranscriber, default_rules_path, default_exceptions_path, jsdict
+except ImportError:
+    from phonetic_transcriber import PhoneticTranscriberData, PhoneticTranscriber, default_rules_path, default_exceptions_path, jsdict
+
+
+# Differential testing of transcription engines against the reference PhoneticTranscriber: both transcribe
+# the same inputs and every difference (including raised exceptions) is reported with a minimized input.
+# ShadowTranscriber does the same for a sample of live calls in production.
+
+log = logging.getLogger('phonetic_transcriber.shadow')
+
+
+def outcome(func, *args):
+    # result or exception type and message, so engines failing the same way compare equal
+    try:
+        return func(*args)
+    except Exception as e:
+        return f'<{type(e).__name__}: {e}>'
+
+
+def random_words(charset, count, seed=0, min_length=1, max_length=12):
+    rnd = random.Random(seed)
+    return [''.join(rnd.choice(charset) for _ in range(rnd.randint(min_length, max_length))) for _ in range(count)]
+
+
+def minimize(word, diverges):
+    # shortest input found by removing chunks of chars, halving chunk size, while diverges(input) holds
+    size = max(1, len(word) // 2)
+    while True:
+        i = 0
+        while i < len(word) and len(word) > 1:
+            candidate = word[:i] + word[i + size:]
+            if candidate and diverges(candidate):
+                word = candidate
+            else:
+                i += size
+        if size == 1:
+            return word
+        size = max(1, size // 2)
+
+
+def compare_engines(reference, candidate, words, max_divergences=10, minimize_inputs=True):
+    # reference and candidate: functions of one word; returns jsdict with number of compared words and divergences
+    diverges = lambda word: outcome(reference, word) != outcome(candidate, word)
+    divergences = []
+    compared = 0
+    seen = set()
+    for word in words:
+        if word in seen:
+            continue
+        seen.add(word)
+        compared += 1
+        expected, result = outcome(reference, word), outcome(candidate, word)
+        if expected == result:
+            continue
+        divergence = jsdict(input=word, expected=expected, result=result)
+        if minimize_inputs:
+            minimized = minimize(word, diverges)
+            if minimized != word:
+                divergence.minimized = jsdict(input=minimized, expected=outcome(reference, minimized), result=outcome(candidate, minimized))
+        divergences.append(divergence)
+        if len(divergences) >= max_divergences:
+            break
+    return jsdict(compared=compared, divergences=divergences)
+
+
+class ShadowTranscriber:
+
+    # Serves every call from reference; a `rate` fraction of transcribe, transcribeText, transcribeChunk and
+    # rules_transcribe calls also runs on candidate and differences are logged and counted.
+    # Other attributes are those of reference.
+
+    own_attributes = ('reference', 'candidate', 'rate', 'random', 'lock', 'comparisons', 'mismatches', 'errors', 'max_logged')
+
+    def __init__(self, reference, candidate, rate=0.01, max_logged=100, seed=None):
+        object.__setattr__(self, 'reference', reference)
+        object.__setattr__(self, 'candidate', candidate)
+        object.__setattr__(self, 'rate', rate)
+        object.__setattr__(self, 'random', random.Random(seed))
+        object.__setattr__(self, 'lock', threading.Lock())
+        object.__setattr__(self, 'comparisons', 0)
+        object.__setattr__(self, 'mismatches', 0)
+        object.__setattr__(self, 'errors', 0)
+        object.__setattr__(self, 'max_logged', max_logged)
+
+    def __getattr__(self, name):
+        return getattr(self.reference, name)
+
+    def __setattr__(self, name, value):
+        if name in self.own_attributes:
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self.reference, name, value)
+
+    def shadow(self, method, result, *args):
+        if self.rate <= 0 or self.random.random() >= self.rate:
+            return result
+        try:
+            candidate = getattr(self.candidate, method)(*args)
+        except Exception as e:
+            with self.lock:
+                self.comparisons += 1
+                self.errors += 1
+                logged = self.errors + self.mismatches <= self.max_logged
+            if logged:
+                log.warning('shadow %s%r raised %s: %s', method, args, type(e).__name__, e)
+            return result
+        with self.lock:
+            self.comparisons += 1
+            mismatch = candidate != result
+            if mismatch:
+                self.mismatches += 1
+            logged = mismatch and self.errors + self.mismatches <= self.max_logged
+        if logged:
+            log.warning('shadow %s%r mismatch: expected %r, got %r', method, args, result, candidate)
+        return result
+
+    def transcribe(self, word, sep=None):
+        return self.shadow('transcribe', self.reference.transcribe(word, sep), word, sep)
+
+    def transcribeText(self, text, preserve_unknown=True, sep='', unknown_sep=''):
+        return self.shadow('transcribeText', self.reference.transcribeText(text, preserve_unknown, sep, unknown_sep),
+                           text, preserve_unknown, sep, unknown_sep)
+
+    def transcribeChunk(self, chunk, preserve_unknown=True, sep='', unknown_sep=''):
+        return self.shadow('transcribeChunk', self.reference.transcribeChunk(chunk, preserve_unknown, sep, unknown_sep),
+                           chunk, preserve_unknown, sep, unknown_sep)
+
+    def rules_transcribe(self, text):
+        return self.shadow('rules_transcribe', self.reference.rules_transcribe(text), text)
+
+    def shadow_stats(self):
+        return jsdict(rate=self.rate, comparisons=self.comparisons, mismatches=self.mismatches, errors=self.errors)
+
+
+def load_engine(spec, data, **kwargs):
+    # spec: MODULE:FACTORY, factory is called with data and kwargs and returns transcriber-like object
+    module, _, name = spec.partition(':')
+    factory = getattr(importlib.import_module(module), name or 'PhoneticTranscriber')
+    return factory(data=data, **kwargs)
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rules', '-r', metavar='FILE', type=str, help='reference rules.json')
+    parser.add_argument('--exceptdb', '-e', metavar='FILE', type=str, help='reference exceptions.json')
+    parser.add_argument('--candidate', metavar='MODULE:FACTORY', type=str, help='candidate engine factory, called with data=PhoneticTranscriberData')
+    parser.add_argument('--candidate-rules', metavar='FILE', type=str, help='candidate rules.json, e.g. pruned by convert_rules.py')
+    parser.add_argument('--candidate-exceptdb', metavar='FILE', type=str, help='candidate exceptions.json')
+    parser.add_argument('--method', '-m', choices=('rules_transcribe', 'transcribe'), default='rules_transcribe', help='compared method')
+    parser.add_argument('--encoder', action='store_true', help='use IPA encoder in both engines')
+    parser.add_argument('--words', '-w', metavar='FILE', action='append', default=[], help='word list file, one word per line')
+    parser.add_argument('--exceptions', action='store_true', help='compare on exception words')
+    parser.add_argument('--random', metavar='N', type=int, default=0, help='compare on N random strings over rule charset')
+    parser.add_argument('--corpus', metavar='N', type=int, default=0, help='compare on N synthetic Latvian-like words')
+    parser.add_argument('--seed', metavar='N', type=int, default=0, help='seed of random strings and synthetic corpus')
+    parser.add_argument('--max-divergences', metavar='N', type=int, default=10, help='stop after N divergences')
+    parser.add_argument('--no-minimize', action='store_true', help='do not minimize divergent inputs')
+    parser.add_argument('--json', '-j', metavar='FILE', type=str, help='write report as json, - for stdout')
+
+    args = parser.parse_args()
+
+    try:
+        from .phonetic_converter import IPACharacterConverter
+    except ImportError:
+        from phonetic_converter import IPACharacterConverter
+
+    rules_path = args.rules or default_rules_path
+    exceptions_path = args.exceptdb or default_exceptions_path
+    data = PhoneticTranscriberData(rules_filepath=rules_path, exceptions_filepath=exceptions_path)
+    candidate_data = PhoneticTranscriberData(rules_filepath=args.candidate_rules or rules_path,
+                                             exceptions_filepath=args.candidate_exceptdb or exceptions_path)
+    kwargs = dict(sep=' ', encoder=IPACharacterConverter() if args.encoder else None)
+    reference = PhoneticTranscriber(data=data, **kwargs)
+    candidate = load_engine(args.candidate, candidate_data, **kwargs) if args.candidate else PhoneticTranscriber(data=candidate_data, **kwargs)
+
+    sources = []
+    for filename in args.words:
+        with open(filename) as f:
+            sources.append((filename, [line.strip() for line in f if line.strip()]))
+    if args.exceptions:
+        sources.append(('exceptions', list(reference.exceptions)))
+    if args.corpus:
+        try:
+            from .benchmark import make_corpus
+        except ImportError:
+            from benchmark import make_corpus
+        sources.append(('corpus', make_corpus(data, seed=args.seed, words=args.corpus, paragraphs=0, exception_share=0).words))
+    if args.random:
+        sources.append(('random', random_words(reference.rule_charset, args.random, seed=args.seed)))
+    if not sources:
+        parser.error('no inputs, use --words, --exceptions, --corpus or --random')
+
+    report = jsdict(method=args.method, sources={})
+    failed = False
+    for name, words in sources:
+        result = compare_engines(getattr(reference, args.method), getattr(candidate, args.method), words,
+                                 max_divergences=args.max_divergences, minimize_inputs=not args.no_minimize)
+        report.sources[name] = result
+        failed = failed or bool(result.divergences)
+        if args.json != '-':
+            print(f'{name}: {result.compared} inputs, {len(result.divergences)} divergences')
+            for divergence in result.divergences:
+                print(f'  {divergence.input!r}: expected {divergence.expected!r}, got {divergence.result!r}')
+                if divergence.minimized:
+                    m = divergence.minimized
+                    print(f'    minimized {m.input!r}: expected {m.expected!r}, got {m.result!r}')
+
+    if args.json:
+        with (open(sys.stdout.fileno(), 'w', closefd=False) if args.json == '-' else open(args.json, 'w')) as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+import re, asyncio
+from functools import lru_cache
+from urllib.parse import parse_qs
+
+
+# Minimal HTTP/1.x request parser for the transcription server, works on raw bytes read from asyncio StreamReader
+
+
+class HTTPError(Exception):
+
+    def __init__(self, status, message=None, headers=None):
+        super().__init__(message or status)
+        self.status = status
+        self.headers = headers or {}
+
+
+class ParserLimits:
+
+    def __init__(self, max_header_size=16*1024, max_headers=64, max_body_size=1024*1024, max_chunk_line=1024):
+        self.max_header_size = max_header_size
+        self.max_headers = max_headers
+        self.max_body_size = max_body_size
+        self.max_chunk_line = max_chunk_line
+
+
+request_line_re = re.compile(rb'([A-Z]+) ([^\s]+) HTTP/(\d)\.(\d)')
+header_name_re = re.compile(rb"[!#$%&'*+\-.^_`|~0-9A-Za-z]+")
+chunk_size_re = re.compile(rb'([0-9A-Fa-f]+)[ \t]*(?:;[^\r\n]*)?')
+content_type_param_re = re.compile(r';\s*([^\s=;]+)\s*=\s*("(?:[^"\\]|\\.)*"|[^\s;]*)')
+
+
+class Request:
+
+    __slots__ = ('method', 'target', 'path', 'query_string', 'version', 'headers', 'body', 'head_size', '_query')
+
+    def __init__(self, method, target, version, headers, body=b''):
+        self.method = method
+        self.target = target
+        self.path, _, self.query_string = target.partition('?')
+        self.version = version
+        self.headers = headers
+        self.body = body
+        self.head_size = 0
+        self._query = None
+
+    @property
+    def query(self):
+        if self._query is None:
+            self._query = parse_qs(self.query_string, keep_blank_values=True)
+        return self._query
+
+    @property
+    def keep_alive(self):
+        connection = self.headers.get('connection', '').lower()
+        if self.version >= (1, 1):
+            return 'close' not in connection
+        return 'keep-alive' in connection
+
+
+def parse_request_head(data, limits):
+    # data is the header block including the terminating empty line
+    lines = data.split(b'\r\n')
+    m = request_line_re.fullmatch(lines[0])
+    if not m:
+        raise HTTPError('400 Bad Request', 'invalid request line')
+    method, target, major, minor = m.groups()
+    headers = {}
+    count = 0
+    for line in lines[1:]:
+        if not line:
+            continue
+        if line[0] in b' \t':
+            raise HTTPError('400 Bad Request', 'obsolete header line folding')
+        name, sep, value = line.partition(b':')
+        if not sep or not header_name_re.fullmatch(name):
+            raise HTTPError('400 Bad Request', 'invalid header line')
+        count += 1
+        if count > limits.max_headers:
+            raise HTTPError('431 Request Header Fields Too Large', 'too many headers')
+        name = name.decode('ascii').lower()
+        value = value.strip(b' \t').decode('latin-1')
+        if name in headers:
+            # recurring headers are combined into comma separated list
+            headers[name] += ', ' + value
+        else:
+            headers[name] = value
+    try:
+        # raw UTF-8 is accepted in targets (e.g. unencoded Latvian query text), like percent-encoded one
+        target = target.decode('utf8')
+    except UnicodeDecodeError:
+        raise HTTPError('400 Bad Request', 'request target is not valid UTF-8')
+    return Request(method.decode('ascii'), target, (int(major), int(minor)), headers)
+
+
+async def read_chunked_body(reader, limits):
+    chunks = []
+    size = 0
+    while True:
+        try:
+            line = await reader.readuntil(b'\r\n')
+        except asyncio.LimitOverrunError:
+            raise HTTPError('400 Bad Request', 'chunk size line too long')
+        if len(line) > limits.max_chunk_line:
+            raise HTTPError('400 Bad Request', 'chunk size line too long')
+        m = chunk_size_re.fullmatch(line, 0, len(line) - 2)
+        if not m:
+            raise HTTPError('400 Bad Request', 'invalid chunk size')
+        chunk_size = int(m.group(1), 16)
+        if chunk_size == 0:
+            break
+        size += chunk_size
+        if size > limits.max_body_size:
+            raise HTTPError('413 Payload Too Large')
+        chunks.append(await reader.readexactly(chunk_size))
+        if await reader.readexactly(2) != b'\r\n':
+            raise HTTPError('400 Bad Request', 'missing chunk terminator')
+    # skip trailer fields
+    trailer_size = 0
+    while True:
+        try:
+            line = await reader.readuntil(b'\r\n')
+        except asyncio.LimitOverrunError:
+            raise HTTPError('431 Request Header Fields Too Large', 'trailer too large')
+        if line == b'\r\n':
+            break
+        trailer_size += len(line)
+        if trailer_size > limits.max_header_size:
+            raise HTTPError('431 Request Header Fields Too Large', 'trailer too large')
+    return b''.join(chunks)
+
+
+async def read_request(reader, limits):
+    # returns None if connection was closed before a new request was started
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return
+        raise
+    except asyncio.LimitOverrunError:
+        raise HTTPError('431 Request Header Fields Too Large')
+    if len(head) > limits.max_header_size:
+        raise HTTPError('431 Request Header Fields Too Large')
+
+    request = parse_request_head(head, limits)
+    request.head_size = len(head)
+    headers = request.headers
+
+    transfer_encoding = headers.get('transfer-encoding')
+    if transfer_encoding is not None:
+        if transfer_encoding.lower() != 'chunked':
+            raise HTTPError('501 Not Implemented', 'unsupported transfer encoding')
+        if 'content-length' in headers:
+            raise HTTPError('400 Bad Request', 'both content-length and transfer-encoding')
+        request.body = await read_chunked_body(reader, limits)
+    elif 'content-length' in headers:
+        length = headers['content-length']
+        if not length.isdigit():
+            raise HTTPError('400 Bad Request', 'invalid content-length')
+        length = int(length)
+        if length > limits.max_body_size:
+            raise HTTPError('413 Payload Too Large')
+        if length:
+            request.body = await reader.readexactly(length)
+
+    return request
+
+
+@lru_cache(maxsize=64)
+def parse_content_type(value):
+    # returns (mime type, parameters); values repeat across requests, so results are cached
+    mime_type, _, params = value.partition(';')
+    params = {key.lower(): value.strip('"') for key, value in content_type_param_re.findall(';' + params)} if params else {}
+    return mime_type.strip().lower(), params
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+try:
+    from .phonetic_transcriber import jsdict, paragraph_split_re, whitespace_re
+except ImportError:
+    from phonetic_transcriber import jsdict, paragraph_split_re, whitespace_re
+
+
+# Incremental transcription of a document that is edited in place. Transcription is local to whitespace separated
+# chunks, so after an edit only paragraphs that changed are looked at and within them only chunks that were not
+# present in the replaced paragraphs are transcribed again. Results are identical to transcriber.transcribeText.
+
+
+class IncrementalTranscriber:
+
+    # not thread safe, use one instance per document
+
+    def __init__(self, transcriber, preserve_unknown=True, sep='', unknown_sep='', preprocess=None):
+        # preprocess: function applied to each chunk before transcription, e.g. clean_text
+        self.transcriber = transcriber
+        self.preserve_unknown = preserve_unknown
+        self.sep = sep
+        self.unknown_sep = unknown_sep
+        self.preprocess = preprocess
+        self.text = ''
+        self.paragraphs = []    # paragraph text
+        self.chunks = []        # per paragraph list of (chunk, tokens)
+        self.results = []       # per paragraph transcription, as in transcribeText result
+        self.version = 0
+        self.chunks_transcribed = 0
+        self.chunks_reused = 0
+        self.update('')
+        self.version = 0
+
+    @property
+    def result(self):
+        if self.sep is True:
+            return list(self.results)
+        return '\n'.join(self.results)
+
+    def transcribe_paragraph(self, paragraph, known):
+        chunks = []
+        tokens = []
+        for chunk in whitespace_re.sub(' ', paragraph).split(' '):
+            chunk_tokens = known.get(chunk)
+            if chunk_tokens is None:
+                self.chunks_transcribed += 1
+                text = self.preprocess(chunk) if self.preprocess else chunk
+                chunk_tokens = known[chunk] = self.transcriber.transcribeChunk(text, self.preserve_unknown, self.sep, self.unknown_sep)
+            else:
+                self.chunks_reused += 1
+            chunks.append((chunk, chunk_tokens))
+            tokens += chunk_tokens
+        return chunks, tokens if self.sep is True else ' '.join(tokens)
+
+    def update(self, text):
+        # replaces document with new version, returns list of changes, each replacing paragraphs [start, end)
+        # of the previous version with new paragraph transcriptions
+        paragraphs = paragraph_split_re.split(text)
+        old = self.paragraphs
+        n = min(len(old), len(paragraphs))
+        start = 0
+        while start < n and old[start] == paragraphs[start]:
+            start += 1
+        end_offset = 0
+        while end_offset < n - start and old[-1 - end_offset] == paragraphs[-1 - end_offset]:
+            end_offset += 1
+        old_end, new_end = len(old) - end_offset, len(paragraphs) - end_offset
+
+        self.text = text
+        self.version += 1
+        if start == old_end and start == new_end:
+            return []
+
+        known = {}
+        for chunks in self.chunks[start:old_end]:
+            known.update(chunks)
+        new_chunks, new_results = [], []
+        for paragraph in paragraphs[start:new_end]:
+            chunks, result = self.transcribe_paragraph(paragraph, known)
+            new_chunks.append(chunks)
+            new_results.append(result)
+
+        self.paragraphs = paragraphs
+        self.chunks[start:old_end] = new_chunks
+        self.results[start:old_end] = new_results
+        return [jsdict(start=start, end=old_end, paragraphs=new_results)]
+
+    def apply(self, start, end, text):
+        # applies edit replacing characters [start, end) of the document with text
+        if not 0 <= start <= end <= len(self.text):
+            raise ValueError(f'edit range {start}:{end} outside of document of length {len(self.text)}')
+        return self.update(self.text[:start] + text + self.text[end:])
+
+    def reset(self, transcriber=None):
+        # transcribes whole document again, e.g. after rules or exceptions were reloaded
+        if transcriber is not None:
+            self.transcriber = transcriber
+        replaced = len(self.paragraphs)
+        self.paragraphs, self.chunks, self.results = [], [], []
+        self.update(self.text)
+        return [jsdict(start=0, end=replaced, paragraphs=list(self.results))]
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+import os, sys, json, math, time, random, socket, asyncio, threading, subprocess
+from collections import defaultdict
+from urllib.parse import quote
+
+try:
+    from .phonetic_transcriber import PhoneticTranscriberData, jsdict
+    from .benchmark import make_corpus
+except ImportError:
+    from phonetic_transcriber import PhoneticTranscriberData, jsdict
+    from benchmark import make_corpus
+
+
+# Load generator for server.py: asyncio clients on persistent connections send a weighted mix of requests
+# for a fixed duration and report throughput, latency percentiles and errors.
+#
+#   python loadtest.py --concurrency 32 --duration 30 --mix word=8,text=1,batch=1 --formats json=1,text=1
+#
+# Without --server, the server is started as subprocess on a free loopback port (or in this process with
+# --in-process), arguments after -- are passed to it.
+
+
+request_kinds = ('word', 'text', 'batch')
+
+
+def parse_weights(value, names):
+    weights = {}
+    for item in value.split(','):
+        name, _, weight = item.partition('=')
+        if name not in names:
+            raise ValueError(f'unknown item {name!r}, expected one of {", ".join(names)}')
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def percentile(sorted_values, q):
+    # nearest rank
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values), max(1, math.ceil(q / 100 * len(sorted_values)))) - 1]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class RequestGenerator:
+
+    def __init__(self, corpus, mix, formats, batch_size=50, seed=0):
+        self.corpus = corpus
+        self.kinds, self.kind_weights = zip(*mix.items())
+        self.formats, self.format_weights = zip(*formats.items())
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+
+    def make(self, host):
+        # returns (kind, format, raw request)
+        rnd = self.random
+        kind = rnd.choices(self.kinds, self.kind_weights)[0]
+        fmt = rnd.choices(self.formats, self.format_weights)[0]
+        if kind == 'word':
+            target = f'/transcribe?fmt={fmt}&word={quote(rnd.choice(self.corpus.words))}'
+            return kind, fmt, f'GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode('ascii')
+        if kind == 'text':
+            body = rnd.choice(self.corpus.paragraphs).encode('utf8')
+            content_type = 'text/plain; charset=utf-8'
+        else:
+            # batch responses are json arrays only
+            fmt = 'json'
+            body = json.dumps({'words': rnd.sample(self.corpus.words, min(self.batch_size, len(self.corpus.words)))}).encode('utf8')
+            content_type = 'application/json'
+        head = f'POST /transcribe?fmt={fmt} HTTP/1.1\r\nHost: {host}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n'
+        return kind, fmt, head.encode('ascii') + body
+
+
+async def read_response(reader):
+    # returns (status, keep alive); reads and discards the body
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ', 2)[1])
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length:
+        await reader.readexactly(length)
+    return status, headers.get('connection', '').lower() != 'close'
+
+
+class Stats:
+
+    def __init__(self):
+        self.latencies = defaultdict(list)    # kind -> seconds
+        self.statuses = defaultdict(int)      # (kind, status) -> count
+        self.errors = defaultdict(int)        # (kind, error) -> count
+        self.connections = 0
+
+    def report(self, duration):
+        def summary(latencies, requests, errors):
+            latencies = sorted(latencies)
+            ms = lambda value: round(value * 1000, 3) if value is not None else None
+            return jsdict(requests=requests, errors=errors, error_rate=errors / requests if requests else 0.0,
+                          throughput=len(latencies) / duration if duration else 0.0,
+                          latency_ms=jsdict(mean=ms(sum(latencies) / len(latencies)) if latencies else None,
+                                            p50=ms(percentile(latencies, 50)), p95=ms(percentile(latencies, 95)),
+                                            p99=ms(percentile(latencies, 99)), max=ms(latencies[-1] if latencies else None)))
+
+        def failed(kind=None):
+            # transport errors and non 2xx/304 responses
+            return sum(count for (k, error), count in self.errors.items() if kind in (None, k)) + \
+                sum(count for (k, status), count in self.statuses.items() if kind in (None, k) and not (200 <= status < 300 or status == 304))
+
+        def requests(kind=None):
+            return sum(count for (k, _), count in self.statuses.items() if kind in (None, k)) + \
+                sum(count for (k, _), count in self.errors.items() if kind in (None, k))
+
+        kinds = sorted(set(self.latencies) | set(k for k, _ in self.errors))
+        result = summary([latency for kind in kinds for latency in self.latencies[kind]], requests(), failed())
+        result.duration = duration
+        result.connections = self.connections
+        result.statuses = {str(status): sum(count for (_, s), count in self.statuses.items() if s == status)
+                           for status in sorted(set(s for _, s in self.statuses))}
+        result.transport_errors = {error: sum(count for (_, e), count in self.errors.items() if e == error)
+                                   for error in sorted(set(e for _, e in self.errors))}
+        result.kinds = {kind: summary(self.latencies[kind], requests(kind), failed(kind)) for kind in kinds}
+        return result
+
+
+async def client(address, generator, stats, deadline, timeout):
+    if address.startswith('unix:'):
+        host = 'localhost'
+        connect = lambda: asyncio.open_unix_connection(address[5:])
+    else:
+        host, _, port = address.rpartition(':')
+        connect = lambda: asyncio.open_connection(host, int(port))
+    reader = writer = None
+    loop = asyncio.get_running_loop()
+    while loop.time() < deadline:
+        kind, _, request = generator.make(host)
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.wait_for(connect(), timeout)
+                stats.connections += 1
+            writer.write(request)
+            status, keep_alive = await asyncio.wait_for(read_response(reader), timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+            stats.errors[kind, type(e).__name__] += 1
+            if writer is not None:
+                writer.close()
+            reader = writer = None
+            continue
+        stats.latencies[kind].append(time.perf_counter() - start)
+        stats.statuses[kind, status] += 1
+        if not keep_alive:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def run_load(address, generator, concurrency=16, duration=10, warmup=1, timeout=10):
+    loop = asyncio.get_running_loop()
+    if warmup > 0:
+        await asyncio.gather(*(client(address, generator, Stats(), loop.time() + warmup, timeout) for _ in range(concurrency)))
+    stats = Stats()
+    start = time.perf_counter()
+    await asyncio.gather(*(client(address, generator, stats, loop.time() + duration, timeout) for _ in range(concurrency)))
+    return stats.report(time.perf_counter() - start)
+
+
+def wait_ready(address, timeout=30, process=None):
+    host, _, port = address.rpartition(':')
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f'server exited with code {process.returncode}')
+        try:
+            with socket.create_connection((host, int(port)), timeout=1) as sock:
+                sock.sendall(b'GET /healthz HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+                if sock.recv(64).startswith(b'HTTP/1.1 200'):
+                    return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f'server at {address} not ready after {timeout}s')
+
+
+def start_server_process(server_args=()):
+    address = f'127.0.0.1:{free_port()}'
+    server = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+    process = subprocess.Popen([sys.executable, server, '--server', address, '--access-log-sample', '0', *server_args])
+    try:
+        wait_ready(address, process=process)
+    except Exception:
+        process.kill()
+        raise
+    return address, process
+
+
+def start_server_thread(**kwargs):
+    # runs server in a daemon thread of this process; it competes with the load generator for the GIL
+    try:
+        from .server import run_server
+        from .phonetic_transcriber import PhoneticTranscriber
+        from .phonetic_converter import IPACharacterConverter
+    except ImportError:
+        from server import run_server
+        from phonetic_transcriber import PhoneticTranscriber
+        from phonetic_converter import IPACharacterConverter
+    address = f'127.0.0.1:{free_port()}'
+    transcriber = PhoneticTranscriber(sep=' ', encoder=IPACharacterConverter())
+    kwargs.setdefault('access_log_sample', 0)
+    threading.Thread(target=run_server, args=(address, transcriber), kwargs=kwargs, daemon=True).start()
+    wait_ready(address)
+    return address
+
+
+def print_report(report):
+    def row(name, summary):
+        latency = summary.latency_ms
+        fmt = lambda value: f'{value:10.2f}' if value is not None else f'{"-":>10}'
+        print(f'{name:<8} {summary.requests:>9} {summary.throughput:>10.1f} {summary.error_rate:>8.2%} '
+              f'{fmt(latency.p50)} {fmt(latency.p95)} {fmt(latency.p99)} {fmt(latency.max)}')
+
+    print(f'{report.duration:.1f}s, {report.connections} connections, statuses {report.statuses}, transport errors {report.transport_errors}')
+    print(f'{"":<8} {"requests":>9} {"req/s":>10} {"errors":>8} {"p50 ms":>10} {"p95 ms":>10} {"p99 ms":>10} {"max ms":>10}')
+    for kind, summary in report.kinds.items():
+        row(kind, summary)
+    row('total', report)
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--server', '-s', metavar='HOST:PORT', help='load test running server at HOST:PORT or unix:PATH instead of starting one')
+    parser.add_argument('--in-process', action='store_true', help='run server in a thread of this process instead of a subprocess')
+    parser.add_argument('--concurrency', '-c', metavar='N', type=int, default=16, help='concurrent client connections')
+    parser.add_argument('--duration', '-d', metavar='SECONDS', type=float, default=10, help='measured duration')
+    parser.add_argument('--warmup', metavar='SECONDS', type=float, default=1, help='unmeasured load before the measurement')
+    parser.add_argument('--timeout', metavar='SECONDS', type=float, default=10, help='request timeout')
+    parser.add_argument('--mix', metavar='KIND=WEIGHT,...', type=str, default='word=8,text=1,batch=1', help='request mix of word GETs, text POSTs and json batch POSTs')
+    parser.add_argument('--formats', metavar='FMT=WEIGHT,...', type=str, default='json=1,text=1', help='response format mix: text, json, msgpack')
+    parser.add_argument('--batch-size', metavar='N', type=int, default=50, help='words per batch request')
+    parser.add_argument('--words', metavar='N', type=int, default=5000, help='distinct words in synthetic corpus')
+    parser.add_argument('--seed', metavar='N', type=int, default=0, help='corpus and request mix seed')
+    parser.add_argument('--json', '-j', metavar='FILE', type=str, help='write report as json, - for stdout')
+    parser.add_argument('server_args', nargs='*', help='arguments passed to started server, after --')
+
+    args = parser.parse_args()
+
+    corpus = make_corpus(PhoneticTranscriberData(), seed=args.seed, words=args.words, paragraphs=200)
+    generator = RequestGenerator(corpus, parse_weights(args.mix, request_kinds), parse_weights(args.formats, ('text', 'json', 'msgpack')),
+                                 batch_size=args.batch_size, seed=args.seed)
+
+    process = None
+    if args.server:
+        address = args.server
+    elif args.in_process:
+        address = start_server_thread()
+    else:
+        address, process = start_server_process(args.server_args)
+
+    try:
+        report = asyncio.run(run_load(address, generator, concurrency=args.concurrency, duration=args.duration,
+                                      warmup=args.warmup, timeout=args.timeout))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    report.config = jsdict(address=address, concurrency=args.concurrency, duration=args.duration, mix=args.mix, formats=args.formats,
+                           batch_size=args.batch_size, words=args.words, seed=args.seed, server_args=args.server_args)
+    if args.json == '-':
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+import time
+from collections import defaultdict, deque
+
+
+# Prometheus text exposition format, see: https://prometheus.io/docs/instrumenting/exposition_formats/
+
+latency_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels) + '}'
+
+
+class Histogram:
+
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def render(self, name, labels=()):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", repr(bound)),))} {cumulative}')
+        lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {self.count}')
+        lines.append(f'{name}_sum{format_labels(labels)} {self.sum}')
+        lines.append(f'{name}_count{format_labels(labels)} {self.count}')
+        return lines
+
+
+class RateWindow:
+
+    # per second rate of a growing counter over the last `window` seconds, computed from periodic samples
+
+    def __init__(self, window=60):
+        self.window = window
+        self.samples = deque()
+
+    def sample(self, total, now=None):
+        now = time.monotonic() if now is None else now
+        self.samples.append((now, total))
+        while len(self.samples) > 2 and self.samples[0][0] < now - self.window:
+            self.samples.popleft()
+
+    def rate(self):
+        if len(self.samples) < 2:
+            return 0.0
+        (t0, v0), (t1, v1) = self.samples[0], self.samples[-1]
+        return (v1 - v0) / (t1 - t0) if t1 > t0 else 0.0
+
+
+class ServerMetrics:
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = defaultdict(int)             # (endpoint, status) -> count
+        self.latency = defaultdict(Histogram)        # endpoint -> histogram
+        self.in_flight = 0
+        self.connections = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.words = RateWindow()
+        self.reloads = {'success': 0, 'failure': 0}
+        self.data_version = None
+
+    def connection_opened(self):
+        self.connections += 1
+        self.in_flight += 1
+
+    def connection_closed(self):
+        self.in_flight -= 1
+
+    def observe_request(self, endpoint, status, latency, bytes_in, bytes_out):
+        self.requests[endpoint, status] += 1
+        self.latency[endpoint].observe(latency)
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+
+    def sample_words(self, total):
+        self.words.sample(total)
+
+    def reload_succeeded(self, version):
+        self.reloads['success'] += 1
+        self.data_version = version
+
+    def reload_failed(self):
+        self.reloads['failure'] += 1
+
+    def render(self, transcriber=None, cache=None):
+        lines = []
+
+        def metric(name, kind, help, samples):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{format_labels(labels)} {value}')
+
+        prefix = 'phonetic_transcriber'
+
+        metric(f'{prefix}_start_time_seconds', 'gauge', 'Server start time since the epoch.', [((), self.started)])
+        metric(f'{prefix}_http_requests_total', 'counter', 'HTTP requests by endpoint and status.',
+               [((('endpoint', endpoint), ('status', status)), count) for (endpoint, status), count in sorted(self.requests.items())])
+
+        lines.append(f'# HELP {prefix}_http_request_duration_seconds HTTP request latency by endpoint.')
+        lines.append(f'# TYPE {prefix}_http_request_duration_seconds histogram')
+        for endpoint, histogram in sorted(self.latency.items()):
+            lines += histogram.render(f'{prefix}_http_request_duration_seconds', (('endpoint', endpoint),))
+
+        metric(f'{prefix}_connections_in_flight', 'gauge', 'Currently open client connections.', [((), self.in_flight)])
+        metric(f'{prefix}_connections_total', 'counter', 'Accepted client connections.', [((), self.connections)])
+        metric(f'{prefix}_http_received_bytes_total', 'counter', 'Request bytes received.', [((), self.bytes_in)])
+        metric(f'{prefix}_http_sent_bytes_total', 'counter', 'Response bytes sent.', [((), self.bytes_out)])
+        metric(f'{prefix}_words_per_second', 'gauge', 'Words transcribed per second, averaged over the last minute.',
+               [((), self.words.rate())])
+
+        metric(f'{prefix}_reloads_total', 'counter', 'Rules and exceptions reloads by result.',
+               [((('result', result),), count) for result, count in self.reloads.items()])
+        if self.data_version is not None:
+            metric(f'{prefix}_data_info', 'gauge', 'Version of the rules and exceptions data being served.',
+                   [((('version', self.data_version),), 1)])
+
+        if transcriber is not None:
+            metric(f'{prefix}_words_total', 'counter', 'Words transcribed by source of the transcription.',
+                   [((('source', 'exceptions'),), transcriber.exception_hits),
+                    ((('source', 'rules'),), transcriber.rule_fallbacks)])
+
+            shadow_stats = getattr(transcriber, 'shadow_stats', None)
+            if shadow_stats:
+                stats = shadow_stats()
+                metric(f'{prefix}_shadow_comparisons_total', 'counter', 'Sampled transcriptions compared with shadow engine by result.',
+                       [((('result', 'match'),), stats.comparisons - stats.mismatches - stats.errors),
+                        ((('result', 'mismatch'),), stats.mismatches), ((('result', 'error'),), stats.errors)])
+            if transcriber.cache is not None:
+                metric(f'{prefix}_shared_cache_requests_total', 'counter', 'Shared memory cache lookups of this process by result.',
+                       [((('result', 'hit'),), transcriber.cache.hits), ((('result', 'miss'),), transcriber.cache.misses)])
+
+        if cache is not None:
+            metric(f'{prefix}_response_cache_requests_total', 'counter', 'Response cache lookups by result.',
+                   [((('result', 'hit'),), cache.hits), ((('result', 'miss'),), cache.misses)])
+            metric(f'{prefix}_response_cache_entries', 'gauge', 'Responses currently cached.', [((), len(cache))])
+
+        lines.append('')
+        return '\n'.join(lines)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import struct
+
+# Minimal MessagePack encoder/decoder for transcription results (nil, bool, int, float, str, bin, array, map),
+# see: https://github.com/msgpack/msgpack/blob/master/spec.md
+# The msgpack package is used instead when it is installed.
+
+
+def _pack(obj, out):
+    if obj is None:
+        out.append(b'\xc0')
+    elif obj is True:
+        out.append(b'\xc3')
+    elif obj is False:
+        out.append(b'\xc2')
+    elif type(obj) is int:
+        if 0 <= obj < 0x80:
+            out.append(struct.pack('B', obj))
+        elif -0x20 <= obj < 0:
+            out.append(struct.pack('b', obj))
+        elif 0 <= obj < 1 << 64:
+            for fmt, code, limit in (('>B', 0xcc, 1 << 8), ('>H', 0xcd, 1 << 16), ('>I', 0xce, 1 << 32), ('>Q', 0xcf, 1 << 64)):
+                if obj < limit:
+                    out.append(bytes((code,)) + struct.pack(fmt, obj))
+                    break
+        elif -(1 << 63) <= obj < 0:
+            for fmt, code, limit in (('>b', 0xd0, 1 << 7), ('>h', 0xd1, 1 << 15), ('>i', 0xd2, 1 << 31), ('>q', 0xd3, 1 << 63)):
+                if obj >= -limit:
+                    out.append(bytes((code,)) + struct.pack(fmt, obj))
+                    break
+        else:
+            raise OverflowError('int too large for msgpack')
+    elif type(obj) is float:
+        out.append(b'\xcb' + struct.pack('>d', obj))
+    elif isinstance(obj, str):
+        data = obj.encode('utf8')
+        n = len(data)
+        if n < 32:
+            out.append(bytes((0xa0 | n,)))
+        elif n < 1 << 8:
+            out.append(b'\xd9' + struct.pack('>B', n))
+        elif n < 1 << 16:
+            out.append(b'\xda' + struct.pack('>H', n))
+        else:
+            out.append(b'\xdb' + struct.pack('>I', n))
+        out.append(data)
+    elif isinstance(obj, (bytes, bytearray)):
+        n = len(obj)
+        if n < 1 << 8:
+            out.append(b'\xc4' + struct.pack('>B', n))
+        elif n < 1 << 16:
+            out.append(b'\xc5' + struct.pack('>H', n))
+        else:
+            out.append(b'\xc6' + struct.pack('>I', n))
+        out.append(bytes(obj))
+    elif isinstance(obj, (list, tuple)):
+        n = len(obj)
+        if n < 16:
+            out.append(bytes((0x90 | n,)))
+        elif n < 1 << 16:
+            out.append(b'\xdc' + struct.pack('>H', n))
+        else:
+            out.append(b'\xdd' + struct.pack('>I', n))
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        n = len(obj)
+        if n < 16:
+            out.append(bytes((0x80 | n,)))
+        elif n < 1 << 16:
+            out.append(b'\xde' + struct.pack('>H', n))
+        else:
+            out.append(b'\xdf' + struct.pack('>I', n))
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    else:
+        raise TypeError(f'can not serialize {type(obj).__name__} to msgpack')
+
+
+def _packb(obj):
+    out = []
+    _pack(obj, out)
+    return b''.join(out)
+
+
+class _Unpacker:
+
+    def __init__(self, data):
+        self.data = data
+        self.p = 0
+
+    def take(self, n):
+        if self.p + n > len(self.data):
+            raise ValueError('truncated msgpack data')
+        chunk = self.data[self.p:self.p + n]
+        self.p += n
+        return chunk
+
+    def unpack_fmt(self, fmt):
+        return struct.unpack(fmt, self.take(struct.calcsize(fmt)))[0]
+
+    def unpack(self):
+        code = self.take(1)[0]
+        if code < 0x80:
+            return code
+        if code >= 0xe0:
+            return code - 0x100
+        if 0xa0 <= code <= 0xbf:
+            return self.take(code & 0x1f).decode('utf8')
+        if 0x90 <= code <= 0x9f:
+            return [self.unpack() for _ in range(code & 0x0f)]
+        if 0x80 <= code <= 0x8f:
+            return self.unpack_map(code & 0x0f)
+        if code == 0xc0:
+            return None
+        if code == 0xc2:
+            return False
+        if code == 0xc3:
+            return True
+        if code in (0xc4, 0xc5, 0xc6):
+            return bytes(self.take(self.unpack_fmt({0xc4: '>B', 0xc5: '>H', 0xc6: '>I'}[code])))
+        if code == 0xca:
+            return self.unpack_fmt('>f')
+        if code == 0xcb:
+            return self.unpack_fmt('>d')
+        if 0xcc <= code <= 0xd3:
+            return self.unpack_fmt(('>B', '>H', '>I', '>Q', '>b', '>h', '>i', '>q')[code - 0xcc])
+        if code in (0xd9, 0xda, 0xdb):
+            return self.take(self.unpack_fmt({0xd9: '>B', 0xda: '>H', 0xdb: '>I'}[code])).decode('utf8')
+        if code in (0xdc, 0xdd):
+            return [self.unpack() for _ in range(self.unpack_fmt('>H' if code == 0xdc else '>I'))]
+        if code in (0xde, 0xdf):
+            return self.unpack_map(self.unpack_fmt('>H' if code == 0xde else '>I'))
+        raise ValueError(f'unsupported msgpack type 0x{code:02x}')
+
+    def unpack_map(self, n):
+        result = {}
+        for _ in range(n):
+            key = self.unpack()
+            result[key] = self.unpack()
+        return result
+
+
+def _unpackb(data):
+    unpacker = _Unpacker(bytes(data))
+    result = unpacker.unpack()
+    if unpacker.p != len(data):
+        raise ValueError('extra data after msgpack object')
+    return result
+
+
+try:
+    import msgpack
+
+    def packb(obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def unpackb(data):
+        return msgpack.unpackb(data, raw=False)
+
+except ImportError:
+    packb = _packb
+    unpackb = _unpackb
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from .phonetic_transcriber import PhoneticTranscriber
+except ImportError:
+    from phonetic_transcriber import PhoneticTranscriber
+
+
+# Columnar batch rule engine. Words are encoded as zero padded uint32 code point matrix plus lengths vector and
+# transcribed in lockstep: at every step each unfinished word is at its own cursor, words are grouped by char
+# under the cursor and the rules of that char (PhoneticTranscriber.rules index, in order) are evaluated as
+# vectorized comparisons over the group, each word taking its first matching rule. Output is identical to
+# PhoneticTranscriber.rules_transcribe. Requires numpy.
+
+
+def compile_context(subrules, metarules):
+    # list of (op, arg); evaluation stops after '#', '^' and '*' like in test_rule
+    ops = []
+    for subrule in subrules:
+        if subrule.tag == 'u':
+            ops.append(('text', [ord(c) for c in subrule.text]))
+        elif subrule.tag != 'm':
+            ops.append(('fail', None))
+            break
+        elif subrule.text == '?':
+            ops.append(('any', None))
+        elif subrule.text in ('#', '^', '*'):
+            ops.append((subrule.text, None))
+            break
+        else:
+            ops.append(('meta', [[ord(c) for c in t] for t in metarules[subrule.text]]))
+    return ops
+
+
+class NumpyRulesEngine:
+
+    def __init__(self, transcriber=None, batch_size=65536):
+        if np is None:
+            raise ImportError('numpy is required for NumpyRulesEngine')
+        self.transcriber = transcriber if transcriber is not None else PhoneticTranscriber()
+        self.batch_size = batch_size
+        self.rule_list = []
+        self.rules_by_code = {}
+        for char, rules in self.transcriber.rules.items():
+            compiled = []
+            for rule in rules:
+                compiled.append((len(self.rule_list), [ord(c) for c in rule.text],
+                                 compile_context(rule.right, self.transcriber.metarules),
+                                 compile_context(rule.left, self.transcriber.metarules)))
+                self.rule_list.append(rule)
+            if compiled:
+                self.rules_by_code[ord(char)] = compiled
+
+    @staticmethod
+    def encode_words(words):
+        lengths = np.fromiter((len(word) for word in words), dtype=np.int64, count=len(words))
+        width = int(lengths.max()) if len(words) else 0
+        codes = np.zeros((len(words), width + 1), dtype=np.uint32)
+        for i, word in enumerate(words):
+            if word:
+                codes[i, :len(word)] = np.frombuffer(word.encode('utf-32-le'), dtype=np.uint32)
+        return codes, lengths
+
+    def match(self, codes, lengths, rows, pos, rule):
+        # mask of rows where rule matches at pos, same logic as PhoneticTranscriber.test_rule
+        _, text, right, left = rule
+        width = codes.shape[1]
+        length = lengths[rows]
+
+        def char_at(p):
+            # 0 outside of the word
+            valid = (p >= 0) & (p < length)
+            return np.where(valid, codes[rows, np.clip(p, 0, width - 1)], 0)
+
+        def text_at(p, chars):
+            ok = char_at(p) == chars[0]
+            for k in range(1, len(chars)):
+                ok &= char_at(p + k) == chars[k]
+            return ok
+
+        ok = text_at(pos, text)
+        p2 = pos + len(text)
+        for op, arg in right:
+            if op == 'text':
+                ok &= text_at(p2, arg)
+                p2 = p2 + len(arg)
+            elif op == 'any':
+                ok &= p2 < length
+                p2 = p2 + 1
+            elif op == 'meta':
+                chosen = np.zeros(len(rows), dtype=bool)
+                next_p2 = p2.copy()
+                for t in arg:
+                    m = ~chosen & (length - p2 >= len(t)) & text_at(p2, t)
+                    next_p2[m] = p2[m] + len(t)
+                    chosen |= m
+                ok &= chosen
+                p2 = next_p2
+            elif op == '#':
+                ok &= p2 >= length
+            elif op == '^':
+                ok &= p2 < length
+            elif op == 'fail':
+                ok[:] = False
+            if not ok.any():
+                return ok
+
+        p2 = pos - 1
+        for op, arg in left:
+            if op == 'text':
+                ok &= (p2 + 1 >= len(arg)) & text_at(p2 - len(arg) + 1, arg)
+                p2 = p2 - len(arg)
+            elif op == 'any':
+                ok &= p2 >= 0
+                p2 = p2 - 1
+            elif op == 'meta':
+                chosen = np.zeros(len(rows), dtype=bool)
+                next_p2 = p2.copy()
+                for t in arg:
+                    m = ~chosen & (p2 + 1 >= len(t)) & text_at(p2 - len(t) + 1, t)
+                    next_p2[m] = p2[m] - len(t)
+                    chosen |= m
+                ok &= chosen
+                p2 = next_p2
+            elif op == '#':
+                ok &= p2 <= -1
+            elif op == '^':
+                ok &= p2 >= 0
+            elif op == 'fail':
+                ok[:] = False
+            if not ok.any():
+                return ok
+        return ok
+
+    def transcribe_chunk(self, words):
+        # returns (list of matched rule ids per word, list of errors or None)
+        codes, lengths = self.encode_words(words)
+        n = len(words)
+        pos = np.zeros(n, dtype=np.int64)
+        steps = np.full((n, codes.shape[1]), -1, dtype=np.int32)
+        step_count = np.zeros(n, dtype=np.int64)
+        failed = np.zeros(n, dtype=bool)
+        errors = [None] * n
+        active = lengths > 0
+        while active.any():
+            rows = np.nonzero(active)[0]
+            chars = codes[rows, pos[rows]]
+            for code in np.unique(chars):
+                group = rows[chars == code]
+                rules = self.rules_by_code.get(int(code))
+                if not rules:
+                    for row in group:
+                        errors[row] = f'No rules for char \'{chr(code)}\' at position {pos[row]}'
+                    failed[group] = True
+                    continue
+                remaining, remaining_pos = group, pos[group]
+                for rule in rules:
+                    m = self.match(codes, lengths, remaining, remaining_pos, rule)
+                    if m.any():
+                        hit = remaining[m]
+                        steps[hit, step_count[hit]] = rule[0]
+                        step_count[hit] += 1
+                        pos[hit] += len(rule[1])
+                        remaining, remaining_pos = remaining[~m], remaining_pos[~m]
+                        if not len(remaining):
+                            break
+                # no rule matched, char is skipped
+                pos[remaining] += 1
+            active = (pos < lengths) & ~failed
+        return steps, step_count, errors
+
+    def rules_transcribe_batch(self, words, errors='raise'):
+        # same as [transcriber.rules_transcribe(word) for word in words]; errors='ignore' gives None for words
+        # with chars without rules instead of raising
+        words = list(words)
+        results = [None] * len(words)
+        # similar lengths in a chunk keep padding and lockstep steps low
+        order = sorted(range(len(words)), key=lambda i: len(words[i]))
+        repls = [rule.repl for rule in self.rule_list]
+        for start in range(0, len(order), self.batch_size):
+            chunk = order[start:start + self.batch_size]
+            steps, step_count, chunk_errors = self.transcribe_chunk([words[i] for i in chunk])
+            for row, i in enumerate(chunk):
+                if chunk_errors[row] is not None:
+                    if errors == 'raise':
+                        raise Exception(chunk_errors[row])
+                    continue
+                result = ''
+                for rule_id in steps[row, :step_count[row]].tolist():
+                    repl = repls[rule_id]
+                    if not result or (repl and repl[0] == '#'):
+                        result += repl
+                    else:
+                        result += '_' + repl
+                results[i] = result
+        return results
+
+    def transcribe_batch(self, words, sep=None):
+        # same as [transcriber.transcribe(word, sep) for word in words]
+        transcriber = self.transcriber
+        words = list(words)
+        raw = [transcriber.exceptions.get(word) for word in words]
+        missing = [i for i, result in enumerate(raw) if not result]
+        transcriber.exception_hits += len(words) - len(missing)
+        transcriber.rule_fallbacks += len(missing)
+        for i, result in zip(missing, self.rules_transcribe_batch([words[i] for i in missing])):
+            raw[i] = result
+        return [transcriber.encode(result, sep) for result in raw]
+
+
+if __name__ == '__main__':
+
+    import sys, argparse
+
+    try:
+        from .phonetic_transcriber import PhoneticTranscriberData, default_rules_path, default_exceptions_path, clean_text
+        from .phonetic_converter import IPACharacterConverter
+    except ImportError:
+        from phonetic_transcriber import PhoneticTranscriberData, default_rules_path, default_exceptions_path, clean_text
+        from phonetic_converter import IPACharacterConverter
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rules', '-r', metavar='FILE', type=str, help='input rules.json')
+    parser.add_argument('--exceptdb', '-e', metavar='FILE', type=str, help='input exceptions.json')
+    parser.add_argument('--input', '-i', metavar='FILE', type=str, default='-', help='word list, one word per line, - for stdin')
+    parser.add_argument('--output', '-o', metavar='FILE', type=str, default='-', help='output TSV of word and transcription, - for stdout')
+    parser.add_argument('--phoneme-sep', '--psep', metavar='SEP', type=str, default=' ', help='phoneme separator')
+    parser.add_argument('--no-encoder', '-E', action='store_true', help='disable IPA character encoder')
+    parser.add_argument('--batch-size', metavar='N', type=int, default=65536, help='words transcribed in lockstep')
+
+    args = parser.parse_args()
+
+    data = PhoneticTranscriberData(rules_filepath=args.rules or default_rules_path, exceptions_filepath=args.exceptdb or default_exceptions_path)
+    engine = NumpyRulesEngine(PhoneticTranscriber(sep=' ', encoder=None if args.no_encoder else IPACharacterConverter(), data=data),
+                              batch_size=args.batch_size)
+
+    with (open(sys.stdin.fileno(), 'r', closefd=False) if args.input == '-' else open(args.input, 'r')) as f:
+        words = [line.strip() for line in f if line.strip()]
+    results = engine.transcribe_batch([clean_text(word) for word in words], sep=args.phoneme_sep)
+    with (open(sys.stdout.fileno(), 'w', closefd=False) if args.output == '-' else open(args.output, 'w')) as f:
+        for word, result in zip(words, results):
+            print(f'{word}\t{result}', file=f)
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-import os, json
+import os, json, time
 
 
 class jsdict(dict):
@@ -22,11 +22,15 @@ basedir = os.path.dirname(__file__)
 # $ python3 -m json.tool --indent 2 --no-ensure-ascii --sort-keys phonetic_converter_dataset_ascii.json phonetic_converter_dataset_unicode.json
 
 dataset = None
+# seconds spent by last load_dataset
+dataset_load_time = None
 
 def load_dataset(filepath=os.path.join(basedir, 'phonetic_converter_dataset.json')):
-    global dataset
+    global dataset, dataset_load_time
+    start = time.perf_counter()
     with open(filepath, 'r') as f:
         dataset = json.load(f, object_hook=jsdict)
+    dataset_load_time = time.perf_counter() - start
 
 
 class AlphaNumericSimplifiedCharacterConverter:
@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 
-import os, json, re, sys, traceback
-from collections import defaultdict
+import os, json, re, sys, traceback, hashlib
+from collections import defaultdict, namedtuple
+from itertools import accumulate, chain
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
 
 try:
     from .phonetic_converter import PhoneticConverter, AlphabeticCharacterConverter
@@ -34,16 +38,46 @@ basedir = os.path.dirname(__file__)
 default_rules_path = os.path.join(basedir, 'rules.json')
 default_exceptions_path = os.path.join(basedir, 'exceptions.json')
 
+paragraph_split_re = re.compile(r'\s*\n\s*')
+whitespace_re = re.compile(r'\s+')
+
+
+# compiled rules: rule text with its replacement and left/right context subrules (left ones in matching order)
+Rule = namedtuple('Rule', 'text repl left right')
+SubRule = namedtuple('SubRule', 'tag text')
+
+
+def compile_rule(rule):
+    return Rule(rule.text, rule.repl, tuple(SubRule(r.tag, r.text) for r in rule.left), tuple(SubRule(r.tag, r.text) for r in rule.right))
+
 
 class PhoneticTranscriberData:
 
     def __init__(self, rules_filepath=default_rules_path, exceptions_filepath=default_exceptions_path):
-        with open(exceptions_filepath, 'r') as f:
-            self._exceptions = json.load(f)
-        with open(rules_filepath, 'r') as f:
-            data = json.load(f, object_hook=jsdict)
-            self._metarules = data.metarules
-            self._rules = data.rules
+        # seconds spent in every loading phase, see PhoneticTranscriber.stats
+        self.timings = jsdict()
+        start = perf_counter()
+        with open(exceptions_filepath, 'rb') as f:
+            exceptions_raw = f.read()
+        with open(rules_filepath, 'rb') as f:
+            rules_raw = f.read()
+        self.timings.read_files = perf_counter() - start
+        start = perf_counter()
+        # content hash of the source files, changes whenever rules or exceptions change
+        self._version = hashlib.sha1(rules_raw + b'\0' + exceptions_raw).hexdigest()[:16]
+        self.timings.hash = perf_counter() - start
+        start = perf_counter()
+        self._exceptions = json.loads(exceptions_raw.decode('utf8'))
+        self.timings.parse_exceptions = perf_counter() - start
+        start = perf_counter()
+        data = json.loads(rules_raw.decode('utf8'), object_hook=jsdict)
+        self._metarules = data.metarules
+        self._rules = data.rules
+        self.timings.parse_rules = perf_counter() - start
+
+    @property
+    def version(self):
+        return self._version
 
     @property
     def exceptions(self):
@@ -61,12 +95,23 @@ class PhoneticTranscriberData:
 
 class PhoneticTranscriber:
 
+    # Compiled state (rules, metarules, exceptions, regexes) is immutable after construction and transcription
+    # methods keep their working state in local variables, so one instance can be shared by threads, also on
+    # free-threaded CPython builds (see transcribe_parallel). Not synchronized: exception_hits/rule_fallbacks
+    # counters (may undercount under concurrent use), enable_rule_stats counters, and reassigning attributes
+    # such as sep while other threads transcribe.
+
     def __init__(self, sep=' ', encoder=None, data=PhoneticTranscriberData(), phoneme_map=None, unknown_map=None):
+        # seconds spent in every construction phase, loading phases of data are in data_timings, see stats
+        self.timings = jsdict()
+        self.data_timings = data.timings
+        start = perf_counter()
         self.sep = sep
         if encoder:
             self.converter = PhoneticConverter(AlphabeticCharacterConverter(), encoder)
         else:
             self.converter = None
+        self.timings.converter = perf_counter() - start
         if phoneme_map:
             self.phoneme_map = phoneme_map
         else:
@@ -76,26 +121,46 @@ class PhoneticTranscriber:
             self.unknown_map = unknown_map
         else:
             self.unknown_map = lambda x: x
-        self.exceptions = data.exceptions
-        self.metarules = data.metarules
-        self.rules = defaultdict(list)
-        for rule in data.rules:
-            self.rules[rule.text[0]].append(rule)    # rules by first char
+        start = perf_counter()
+        self.exceptions = MappingProxyType(data.exceptions)
+        self.metarules = MappingProxyType({name: tuple(texts) for name, texts in data.metarules.items()})
+        # identifies output of this transcriber: data files + encoder
+        self.version = data.version + (f'-{type(encoder).__name__}' if encoder else '')
+        # words resolved by exception db vs by rules
+        self.exception_hits = 0
+        self.rule_fallbacks = 0
+        # optional lookup tier for words transcribed by rules, see attach_cache
+        self.data_version = data.version
+        self.cache = None
+        self.cache_tag = None
+        self.rule_list = tuple(compile_rule(rule) for rule in data.rules)
+        self.rule_stats = None
+        self.timings.compile_rules = perf_counter() - start
+        start = perf_counter()
+        rules = defaultdict(list)
+        for rule in self.rule_list:
+            rules[rule.text[0]].append(rule)    # rules by first char
+        self.rules = MappingProxyType({char: tuple(char_rules) for char, char_rules in rules.items()})
+        # chars from the cursor read by testing rules by first char up to and including the j-th, see rules_transcribe_many
+        self.rule_reach = MappingProxyType({char: tuple(accumulate((self.rule_span(rule) for rule in rules), max)) for char, rules in self.rules.items()})
+        self.timings.index_rules = perf_counter() - start
+        start = perf_counter()
         self.rule_control_chars = '?#^*'    # special symbols used
         rule_charset = set()
-        for rule in data.rules:
+        for rule in self.rule_list:
             rule_charset |= set(rule.text)
             for r in rule.left:
                 rule_charset |= set(r.text)
             for r in rule.right:
                 rule_charset |= set(r.text)
-        for _,ts in data.metarules.items():
+        for _,ts in self.metarules.items():
             for t in ts:
                 rule_charset |= set(t)
         self.rule_charset = ''.join(sorted(rule_charset - set(self.rule_control_chars)))
         charset = self.rule_charset.replace('-', '\\-').replace('^', '\\^').replace('[', '\\[').replace(']', '\\]')
         self.not_charset_re = re.compile('([^%s]+)' % charset)
         self.charset_re = re.compile('([%s]+)' % charset)
+        self.timings.charset = perf_counter() - start
 
 
     def test_rule(self, rule, text, p):
@@ -190,7 +255,7 @@ class PhoneticTranscriber:
         result = ''
         p = 0
         while p < len(text):
-            rules = self.rules[text[p]]
+            rules = self.rules.get(text[p])
             if not rules:
                 raise Exception(f'No rules for char \'{text[p]}\' at position {p}')
             rule = None
@@ -208,33 +273,260 @@ class PhoneticTranscriber:
             p += len(rule.text)
         return result
 
+    def rule_span(self, rule):
+        # number of chars from the rule position test_rule may read; '#', '^' and '?' test whether a char exists
+        span = len(rule.text)
+        for subrule in rule.right:
+            if subrule.tag == 'u':
+                span += len(subrule.text)
+            elif subrule.tag != 'm' or subrule.text == '*':
+                break
+            elif subrule.text in ('?', '#', '^'):
+                span += 1
+                if subrule.text != '?':
+                    break
+            else:
+                span += max((len(t) for t in self.metarules.get(subrule.text, ())), default=0)
+        return span
+
+    def rules_transcribe_many(self, words, errors='raise'):
+        # same as [self.rules_transcribe(word) for word in words]; errors='ignore' gives None for words with chars
+        # without rules instead of raising. Words are processed in sorted order and each word resumes from the state
+        # of the previous one after the last rule decision that read chars of their common prefix only: left contexts
+        # are always inside the prefix, right contexts are bounded by rule_span. Pays off on sorted lexicons with shared
+        # stems only (~1.2-1.4x on benchmark.py rules_transcribe_many[inflected]), running text gains nothing.
+        words = list(words)
+        results = [None] * len(words)
+        if 'rules_transcribe' in self.__dict__:
+            # instrumented matcher, counters must see every word
+            for i, word in enumerate(words):
+                try:
+                    results[i] = self.rules_transcribe(word)
+                except Exception:
+                    if errors == 'raise':
+                        raise
+            return results
+        rules_get = self.rules.get
+        rule_reach = self.rule_reach
+        test_rule = self.test_rule
+        prev = ''
+        result = ''
+        p = 0
+        # (position, result length, end of chars read) before every rule decision made for prev
+        states = []
+        for i in sorted(range(len(words)), key=words.__getitem__):
+            text = words[i]
+            common = 0
+            for a, b in zip(prev, text):
+                if a != b:
+                    break
+                common += 1
+            # decisions that read chars of the common prefix only are kept, matching resumes after them
+            k = 0
+            for state in states:
+                if state[2] > common:
+                    p, n, _ = state
+                    result = result[:n]
+                    del states[k:]
+                    break
+                k += 1
+            prev = text
+            error = None
+            while p < len(text):
+                char = text[p]
+                rules = rules_get(char)
+                if not rules:
+                    error = f'No rules for char \'{char}\' at position {p}'
+                    break
+                rule = None
+                for j, r in enumerate(rules):
+                    if test_rule(r, text, p):
+                        rule = r
+                        break
+                # rules after the matching one are not tested
+                states.append((p, len(result), p + rule_reach[char][j]))
+                if not rule:
+                    p += 1
+                    continue
+                if not result or (rule.repl and rule.repl[0] == '#'):
+                    result += rule.repl
+                else:
+                    result += '_' + rule.repl
+                p += len(rule.text)
+            if error is not None:
+                if errors == 'raise':
+                    raise Exception(error)
+                continue
+            results[i] = result
+        return results
+
+    def enable_rule_stats(self):
+        # replaces rules_transcribe by instrumented version collecting per rule counters into self.rule_stats,
+        # the attached cache is bypassed meanwhile so every rules transcribed word is counted
+        try:
+            from .rule_stats import RuleStats, instrumented_rules_transcribe
+        except ImportError:
+            from rule_stats import RuleStats, instrumented_rules_transcribe
+        if self.rule_stats is None:
+            self.rule_stats = RuleStats(self.rule_list)
+        stats = self.rule_stats
+        self.rules_transcribe = lambda text: instrumented_rules_transcribe(self, stats, text)
+        return stats
+
+    def disable_rule_stats(self):
+        # back to uninstrumented rules_transcribe, collected counters are kept
+        self.__dict__.pop('rules_transcribe', None)
+
+    def stats(self, extra_timings=None, extra_objects=None):
+        # phase timings and approximate memory held by compiled state, see startup_stats.transcriber_stats
+        try:
+            from .startup_stats import transcriber_stats
+        except ImportError:
+            from startup_stats import transcriber_stats
+        return transcriber_stats(self, extra_timings, extra_objects)
+
+    def explain(self, word):
+        try:
+            from .rule_stats import explain
+        except ImportError:
+            from rule_stats import explain
+        return explain(self, word, self.rule_stats.index if self.rule_stats else None)
+
     def split_unknown(self, text):
         return [jsdict(text=part, unknown=self.charset_re.match(part) is None) for part in self.not_charset_re.split(text) if part]
 
+    def iter_transcribe_chunk(self, chunk, preserve_unknown=True, sep='', offset=0):
+        # word and unknown events of whitespace free chunk, source offsets start at offset
+        for part in self.not_charset_re.split(chunk):
+            if not part:
+                continue
+            if self.charset_re.match(part) is not None:
+                yield jsdict(type='word', text=part, start=offset, end=offset + len(part), result=self.transcribe(part, sep=sep))
+            elif preserve_unknown:
+                yield jsdict(type='unknown', text=part, start=offset, end=offset + len(part), result=self.unknown_map(part))
+            offset += len(part)
+
+    def iter_transcribe_text(self, text, preserve_unknown=True, sep=''):
+        # lazily transcribes text, yields events with source offsets [start, end): paragraph at start of every
+        # paragraph, chunk for every whitespace separated span (empty at paragraph edges with whitespace), followed
+        # by word and unknown events of the chunk
+        start = 0
+        for paragraph in chain(paragraph_split_re.finditer(text), (None,)):
+            end = paragraph.start() if paragraph else len(text)
+            yield jsdict(type='paragraph', start=start, end=end)
+            chunk_start = start
+            for space in chain(whitespace_re.finditer(text, start, end), (None,)):
+                chunk_end = space.start() if space else end
+                yield jsdict(type='chunk', start=chunk_start, end=chunk_end)
+                yield from self.iter_transcribe_chunk(text[chunk_start:chunk_end], preserve_unknown, sep, chunk_start)
+                if space:
+                    chunk_start = space.end()
+            if paragraph:
+                start = paragraph.end()
+
+    def transcribeChunk(self, chunk, preserve_unknown=True, sep='', unknown_sep=''):
+        # transcribes whitespace free chunk of text, returns list of tokens contributed to its paragraph
+        results = [event['result'] for event in self.iter_transcribe_chunk(chunk, preserve_unknown, sep)]
+        if not preserve_unknown or sep is True:
+            # without unknown chars or as array every token is kept
+            return results
+        return [unknown_sep.join(results)]
+
+    def iter_transcribed_paragraphs(self, text, preserve_unknown=True, sep='', unknown_sep=''):
+        # transcribeText output one paragraph at a time
+        def paragraph(chunks):
+            if sep is True:
+                return [result for results in chunks for result in results]
+            if not preserve_unknown:
+                return ' '.join(result for results in chunks for result in results)
+            return ' '.join(unknown_sep.join(results) for results in chunks)
+
+        chunks = None
+        for event in self.iter_transcribe_text(text, preserve_unknown, sep):
+            kind = event['type']
+            if kind == 'paragraph':
+                if chunks is not None:
+                    yield paragraph(chunks)
+                chunks = []
+            elif kind == 'chunk':
+                chunks.append([])
+            else:
+                chunks[-1].append(event['result'])
+        yield paragraph(chunks)
+
     def transcribeText(self, text, preserve_unknown=True, sep='', unknown_sep=''):
-        ws_re = re.compile(r'\s+')
-        paragraphs = []
-        for paragraph in re.split(r'\s*\n\s*', text):
-            tokens = []
-            # collapse whitespaces and split into chunks by whitespace
-            for chunk in ws_re.sub(' ', paragraph).split(' '):
-                if not preserve_unknown:
-                    # in this mode we discard unknown char tokens
-                    tokens += [self.transcribe(t.text, sep=sep) for t in self.split_unknown(chunk) if not t.unknown]
-                elif sep is True:
-                    tokens += [self.unknown_map(t.text) if t.unknown else self.transcribe(t.text, sep=sep) for t in self.split_unknown(chunk)]
-                else:
-                    tokens.append(unknown_sep.join(self.unknown_map(t.text) if t.unknown else self.transcribe(t.text, sep=sep) for t in self.split_unknown(chunk)))
-            paragraphs.append(tokens if sep is True else ' '.join(tokens))
+        paragraphs = self.iter_transcribed_paragraphs(text, preserve_unknown, sep, unknown_sep)
         if sep is True:
-            return paragraphs
+            return list(paragraphs)
         return '\n'.join(paragraphs)
 
+    def attach_cache(self, cache):
+        # starts using cache (e.g. shared_cache.SharedTranscriptionCache) for rules output, which depends on data only;
+        # binding drops cached entries of other data versions node wide, so attach only the transcriber that serves
+        self.cache_tag = cache.bind(self.data_version) if cache is not None else None
+        self.cache = cache
+
+    def rules_cache(self):
+        # attached cache, None while rule stats are collected: cached words would never reach the instrumented matcher
+        return self.cache if 'rules_transcribe' not in self.__dict__ else None
+
     def transcribe(self, word, sep=None):
         # word = word.lower()
         result = self.exceptions.get(word)
         if not result:
-            result = self.rules_transcribe(word)
+            self.rule_fallbacks += 1
+            cache = self.rules_cache()
+            if cache is not None:
+                result = cache.get(word, self.cache_tag)
+                if result is None:
+                    result = self.rules_transcribe(word)
+                    cache.put(word, result, self.cache_tag)
+            else:
+                result = self.rules_transcribe(word)
+        else:
+            self.exception_hits += 1
+        return self.encode(result, sep)
+
+    def transcribe_many(self, words, sep=None):
+        # same as [self.transcribe(word, sep) for word in words], words not in exceptions go through rules_transcribe_many
+        words = list(words)
+        results = [self.exceptions.get(word) for word in words]
+        missing = [i for i, result in enumerate(results) if not result]
+        self.exception_hits += len(words) - len(missing)
+        self.rule_fallbacks += len(missing)
+        cache = self.rules_cache()
+        if cache is not None:
+            for i in missing:
+                results[i] = cache.get(words[i], self.cache_tag)
+            missing = [i for i in missing if results[i] is None]
+        for i, result in zip(missing, self.rules_transcribe_many([words[i] for i in missing])):
+            results[i] = result
+            if cache is not None:
+                cache.put(words[i], result, self.cache_tag)
+        return [self.encode(result, sep) for result in results]
+
+    def transcribe_parallel(self, words, sep=None, workers=None, executor=None, chunk_size=1024):
+        # transcribe_many on chunks of consecutive sorted words run by thread pool, returns results in words order;
+        # scales with cores on free-threaded builds, with GIL the threads take turns
+        words = list(words)
+        order = sorted(range(len(words)), key=words.__getitem__)
+        chunks = [[words[i] for i in order[start:start + chunk_size]] for start in range(0, len(order), chunk_size)]
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(workers)
+        try:
+            results = [None] * len(words)
+            positions = iter(order)
+            for chunk_results in executor.map(lambda chunk: self.transcribe_many(chunk, sep), chunks):
+                for result in chunk_results:
+                    results[next(positions)] = result
+        finally:
+            if own_executor:
+                executor.shutdown()
+        return results
+
+    def encode(self, result, sep=None):
+        # converts raw '_' separated transcription (exceptions db or rules output) to output form
         tokens = result.split("_")
         if self.converter:
             tokens = self.converter.convertTokens(tokens)
@@ -338,12 +630,25 @@ if __name__ == '__main__':
     parser.add_argument('--phoneme-map-fmt', metavar='FMT', type=str, default='auto', help='phoneme map file format')
     parser.add_argument('--unknown-map', metavar='FILE', type=str, help='load unknown map from file (autodetect json or tsv by extension or specify --unknown-map-fmt)')
     parser.add_argument('--unknown-map-fmt', metavar='FMT', type=str, default='auto', help='unknown map file format')
+    parser.add_argument('--explain', '-x', action='store_true', help='show rules used to transcribe input words')
+    parser.add_argument('--rule-stats', metavar='N', type=int, nargs='?', const=20, help='print N most time consuming rules after transcription')
     parser.add_argument('--no-encoder', '-E', action='store_true', help='disable IPA character encoder')
-    parser.add_argument('--server', '-s', metavar='HOST:PORT', help='run server listening on [HOST]:PORT')
+    parser.add_argument('--profile-startup', action='store_true', help='print time of loading phases and memory held by loaded data')
+    parser.add_argument('--cprofile', metavar='FILE', type=str, help='profile whole run with cProfile, write pstats to FILE at exit')
+    parser.add_argument('--tracemalloc', metavar='FILE', type=str, help='trace allocations, write tracemalloc snapshot to FILE at exit')
+    parser.add_argument('--server', '-s', metavar='HOST:PORT', help='run server listening on [HOST]:PORT or unix:PATH')
     parser.add_argument('word', nargs='*', type=str, help='input word to transcribe')
 
     args = parser.parse_args()
 
+    if args.cprofile or args.tracemalloc:
+        import atexit
+        try:
+            from .startup_stats import Profiling
+        except ImportError:
+            from startup_stats import Profiling
+        atexit.register(Profiling(args.cprofile, args.tracemalloc).stop)
+
     if args.sep:
         args.phoneme_sep = args.sep
         args.unknown_sep = args.sep
@@ -359,21 +664,35 @@ if __name__ == '__main__':
     except ImportError:
         from phonetic_converter import IPACharacterConverter
 
+    start = perf_counter()
+    maps = {}
     try:
         phoneme_map = None
         unknown_map = None
         if args.phoneme_map:
-            phoneme_map = load_map_file(args.phoneme_map, args.phoneme_map_fmt).__getitem__
+            maps['phoneme_map'] = load_map_file(args.phoneme_map, args.phoneme_map_fmt)
+            phoneme_map = maps['phoneme_map'].__getitem__
         if args.unknown_map:
-            unknown_symbol_map = load_map_file(args.unknown_map, args.unknown_map_fmt)
+            unknown_symbol_map = maps['unknown_map'] = load_map_file(args.unknown_map, args.unknown_map_fmt)
             unknown_map = lambda s: ''.join(map(unknown_symbol_map.__getitem__, s))
     except Exception as e:
         # print(traceback.format_exc(), file=sys.stderr)
         print(f'warning: {e}', file=sys.stderr)
+    load_maps_time = perf_counter() - start
 
     transcriber = PhoneticTranscriber(sep=' ', encoder=None if args.no_encoder else IPACharacterConverter(), data=data,
                                       phoneme_map=phoneme_map, unknown_map=unknown_map)
 
+    if args.profile_startup:
+        try:
+            from .startup_stats import format_stats
+        except ImportError:
+            from startup_stats import format_stats
+        print(format_stats(transcriber.stats(extra_timings=dict(load_maps=load_maps_time), extra_objects=maps)), file=sys.stderr)
+
+    if args.rule_stats is not None:
+        transcriber.enable_rule_stats()
+
     phoneme_sep = True if args.phoneme_sep == 'array' else args.phoneme_sep
     unknown_sep = args.unknown_sep
     preserve_unknown = not args.skip_unknown
@@ -431,6 +750,19 @@ if __name__ == '__main__':
             for word in args.word:
                 print(f'transcribing input: {word}', end=' ' * max(1, 20 - len(word)), flush=True)
                 print('result:', transcriber.transcribe(clean_text(word), sep=phoneme_sep))
+                if args.explain:
+                    explanation = transcriber.explain(clean_text(word))
+                    if explanation.source == 'exceptions':
+                        print(f'    from exceptions: {explanation.result}')
+                    for step in explanation.steps:
+                        print(f'    {step.position:>3} {step.text:<6} {step.repl or "-":<10} rule #{step.index} {step.rule or "no match"} ({step.tried} tried)')
+
+    if args.rule_stats is not None:
+        summary = transcriber.rule_stats.summary()
+        print(f'rule stats: {summary.words} words, {summary.attempts} rule tests, {summary.matches} matches, '
+              f'{summary.time * 1000:.2f} ms, {summary.rules_never_matched} rules never matched', file=sys.stderr)
+        for row in transcriber.rule_stats.report(top=args.rule_stats):
+            print(f'  #{row.index:<4} {row.attempts:>8} tried {row.matches:>8} matched {row.time * 1e6:>10.1f} us  {row.rule}', file=sys.stderr)
 
     if args.server:
         try:
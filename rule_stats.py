@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+from time import perf_counter
+
+try:
+    from .phonetic_transcriber import jsdict
+except ImportError:
+    from phonetic_transcriber import jsdict
+
+
+# Rule instrumentation for PhoneticTranscriber. The instrumented matcher replaces rules_transcribe only while
+# enabled (PhoneticTranscriber.enable_rule_stats), the default matcher is not touched.
+
+
+def format_subrules(subrules):
+    return ''.join(subrule.text if subrule.tag == 'u' or subrule.text in ('?', '#', '^', '*') else f'<{subrule.text}>' for subrule in subrules)
+
+
+def format_rule(rule):
+    # left context is matched outwards from the rule text, shown in reading order
+    return f'{format_subrules(reversed(rule.left))}[{rule.text}]{format_subrules(rule.right)} -> {rule.repl}'
+
+
+class RuleStats:
+
+    def __init__(self, rules):
+        # rules in rules.json order, which is also their priority among rules starting with the same char
+        self.rules = list(rules)
+        self.index = {id(rule): i for i, rule in enumerate(self.rules)}
+        self.reset()
+
+    def reset(self):
+        n = len(self.rules)
+        self.attempts = [0] * n
+        self.matches = [0] * n
+        self.time = [0.0] * n
+        self.words = 0
+        self.skipped_chars = 0
+
+    def report(self, sort='time', top=None):
+        # per rule counters, sorted by descending `sort` key: time, attempts, matches, failures or index
+        rows = [jsdict(index=i, rule=format_rule(rule), attempts=self.attempts[i], matches=self.matches[i],
+                       failures=self.attempts[i] - self.matches[i], time=self.time[i])
+                for i, rule in enumerate(self.rules)]
+        if sort != 'index':
+            rows.sort(key=lambda row: row[sort], reverse=True)
+        return rows[:top] if top else rows
+
+    def merge(self, other):
+        # adds counters of other, collected for an equal rule list (e.g. before a reload of unchanged rules)
+        for i in range(len(self.rules)):
+            self.attempts[i] += other.attempts[i]
+            self.matches[i] += other.matches[i]
+            self.time[i] += other.time[i]
+        self.words += other.words
+        self.skipped_chars += other.skipped_chars
+
+    def never_matched(self):
+        return [jsdict(index=i, rule=format_rule(rule), attempts=self.attempts[i]) for i, rule in enumerate(self.rules) if not self.matches[i]]
+
+    def summary(self):
+        attempts = sum(self.attempts)
+        matches = sum(self.matches)
+        return jsdict(words=self.words, attempts=attempts, matches=matches, failures=attempts - matches,
+                      attempts_per_match=attempts / matches if matches else None, time=sum(self.time),
+                      skipped_chars=self.skipped_chars, rules_never_matched=sum(1 for count in self.matches if not count))
+
+
+def instrumented_rules_transcribe(transcriber, stats, text):
+    # same as PhoneticTranscriber.rules_transcribe, counting and timing every test_rule call
+    index, attempts, matches, times = stats.index, stats.attempts, stats.matches, stats.time
+    test_rule = transcriber.test_rule
+    stats.words += 1
+    result = ''
+    p = 0
+    while p < len(text):
+        rules = transcriber.rules.get(text[p])
+        if not rules:
+            raise Exception(f'No rules for char \'{text[p]}\' at position {p}')
+        rule = None
+        for r in rules:
+            i = index[id(r)]
+            attempts[i] += 1
+            start = perf_counter()
+            matched = test_rule(r, text, p)
+            times[i] += perf_counter() - start
+            if matched:
+                matches[i] += 1
+                rule = r
+                break
+        if not rule:
+            stats.skipped_chars += 1
+            p += 1
+            continue
+        if not result or (rule.repl and rule.repl[0] == '#'):
+            result += rule.repl
+        else:
+            result += '_' + rule.repl
+        p += len(rule.text)
+    return result
+
+
+def explain(transcriber, word, rules_index=None):
+    # returns how word is transcribed: source (exceptions or rules), raw result and for rules every step
+    # with position, consumed text, rule, its output and number of rules tried before it matched
+    result = transcriber.exceptions.get(word)
+    if result:
+        return jsdict(word=word, source='exceptions', result=result, steps=[])
+    rules_index = rules_index or {id(rule): i for i, rule in enumerate(transcriber.rule_list)}
+    steps = []
+    result = ''
+    p = 0
+    while p < len(word):
+        rules = transcriber.rules.get(word[p])
+        if not rules:
+            raise Exception(f'No rules for char \'{word[p]}\' at position {p}')
+        rule = None
+        for tried, r in enumerate(rules, 1):
+            if transcriber.test_rule(r, word, p):
+                rule = r
+                break
+        if not rule:
+            steps.append(jsdict(position=p, text=word[p], rule=None, index=None, repl=None, tried=len(rules)))
+            p += 1
+            continue
+        steps.append(jsdict(position=p, text=rule.text, rule=format_rule(rule), index=rules_index.get(id(rule)), repl=rule.repl, tried=tried))
+        if not result or (rule.repl and rule.repl[0] == '#'):
+            result += rule.repl
+        else:
+            result += '_' + rule.repl
+        p += len(rule.text)
+    return jsdict(word=word, source='rules', result=result, steps=steps)
@@ -1,9 +1,48 @@
 #!/usr/bin/env python3
 
-import re, asyncio, traceback, json, sys
+import os, stat, asyncio, json, sys, hashlib, hmac, ipaddress, signal, logging, logging.handlers, queue, random, time, gzip, zlib
+from concurrent.futures import ThreadPoolExecutor
 from asyncio.streams import StreamReader, StreamWriter
+from collections import OrderedDict
+from itertools import islice
 from contextlib import closing
-from urllib.parse import parse_qs
+
+try:
+    from .msgpack_lite import packb
+    from .http_parser import HTTPError, ParserLimits, read_request, parse_content_type
+    from .websocket_protocol import WebSocket, WebSocketError, is_upgrade_request, handshake_headers, \
+        OP_TEXT, OP_BINARY, CLOSE_GOING_AWAY, CLOSE_UNSUPPORTED_DATA, CLOSE_INVALID_DATA, CLOSE_INTERNAL_ERROR, CLOSE_TRY_AGAIN_LATER
+except ImportError:
+    from msgpack_lite import packb
+    from http_parser import HTTPError, ParserLimits, read_request, parse_content_type
+    from websocket_protocol import WebSocket, WebSocketError, is_upgrade_request, handshake_headers, \
+        OP_TEXT, OP_BINARY, CLOSE_GOING_AWAY, CLOSE_UNSUPPORTED_DATA, CLOSE_INVALID_DATA, CLOSE_INTERNAL_ERROR, CLOSE_TRY_AGAIN_LATER
+
+
+log = logging.getLogger('phonetic_transcriber.server')
+access_log = logging.getLogger('phonetic_transcriber.server.access')
+
+
+def setup_logging(level='info'):
+    # log records are formatted and written by a background thread, request handlers only enqueue them,
+    # so a slow stdout/stderr consumer cannot stall the event loop;
+    # does nothing if the application has already configured handlers for our loggers
+    logger = logging.getLogger('phonetic_transcriber')
+    logger.setLevel(level.upper() if type(level) is str else level)
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.propagate = False
+    listener.start()
+    return listener
+
+
+class ServerOverloaded(Exception):
+    pass
 
 
 # solution idea from: https://github.com/aio-libs/async-timeout/blob/master/async_timeout/__init__.py
@@ -27,17 +66,314 @@ class async_timeout:
         task.cancel()
 
 
+class ResponseCache:
+
+    # LRU cache of serialized responses keyed by normalized request parameters
+
+    def __init__(self, maxsize=1024, max_entry_size=64*1024):
+        self.maxsize = maxsize
+        self.max_entry_size = max_entry_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        if self.maxsize <= 0 or len(entry.body) > self.max_entry_size:
+            return
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __bool__(self):
+        # an enabled cache is truthy even while empty, __len__ would make it falsy
+        return True
+
+
+def make_etag(version, key):
+    # strong validator: same data version and same normalized request yield byte-identical responses
+    return '"%s"' % hashlib.sha1(repr((version, key)).encode('utf8')).hexdigest()[:32]
+
+
+def encoded_etag(etag, encoding):
+    # each content coding is a different representation and needs its own strong validator
+    return etag if encoding == 'identity' else f'{etag[:-1]}-{encoding}"'
+
+
+def matching_etag(etag, if_none_match):
+    # returns the tag (for any content coding of the response) matched by If-None-Match, None otherwise
+    etags = {encoded_etag(etag, encoding) for encoding in content_encodings}
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return etag
+        if tag.startswith('W/'):
+            # If-None-Match uses weak comparison
+            tag = tag[2:]
+        if tag in etags:
+            return tag
+
+
+# supported content codings in order of server preference
+content_encodings = ('gzip', 'deflate', 'identity')
+
+
+def negotiate_encoding(accept_encoding):
+    quality = {}
+    for item in accept_encoding.split(','):
+        coding, *params = item.strip().split(';')
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding == 'x-gzip':
+            coding = 'gzip'
+        quality[coding] = q
+    # any acceptable compression is preferred over identity
+    best, best_q = 'identity', 0.0
+    for coding in content_encodings[:-1]:
+        q = quality.get(coding, quality.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body, encoding, level=6):
+    if encoding == 'gzip':
+        # fixed mtime keeps output byte-identical, as required by the strong ETag
+        return gzip.compress(body, compresslevel=level, mtime=0)
+    if encoding == 'deflate':
+        return zlib.compress(body, level)
+    return body
+
+
+def decompress(body, encoding, max_size):
+    # raises HTTPError for unsupported encodings and ValueError when decompressed data would exceed max_size
+    if encoding == 'gzip' or encoding == 'x-gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+    else:
+        raise HTTPError('415 Unsupported Media Type', f'unsupported content encoding {encoding}')
+    data = decompressor.decompress(body, max_size + 1)
+    if len(data) > max_size or decompressor.unconsumed_tail:
+        raise ValueError('decompressed body too large')
+    return data
+
+
+# response formats in order of server preference
+response_formats = {
+    'text': 'text/plain; charset=utf-8',
+    'json': 'application/json; charset=utf-8',
+    'msgpack': 'application/msgpack',
+}
+
+mime_formats = {
+    'text/plain': 'text',
+    'application/json': 'json',
+    'application/msgpack': 'msgpack',
+    'application/x-msgpack': 'msgpack',
+}
+
+
+def negotiate_format(accept):
+    # returns the supported format with the highest q value in Accept header (ties go to server preference),
+    # None if none of the formats are acceptable
+    quality = {}
+    for item in accept.split(','):
+        mime_type, *params = item.strip().split(';')
+        mime_type = mime_type.strip().lower()
+        q = 1.0
+        for param in params:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if mime_type == '*/*':
+            specificity, fmts = 0, list(response_formats)
+        elif mime_type.endswith('/*'):
+            specificity, fmts = 1, [fmt for mime, fmt in mime_formats.items() if mime.startswith(mime_type[:-1])]
+        else:
+            specificity, fmts = 2, [mime_formats[mime_type]] if mime_type in mime_formats else []
+        for fmt in fmts:
+            # the most specific matching media range determines q
+            if fmt not in quality or quality[fmt][0] < specificity:
+                quality[fmt] = (specificity, q)
+    best = None
+    for fmt in response_formats:
+        if fmt in quality and quality[fmt][1] > 0 and (best is None or quality[fmt][1] > quality[best][1]):
+            best = fmt
+    return best
+
+
+def serialize_result(result, fmt, pretty=False):
+    if fmt == 'json':
+        if pretty:
+            return json.dumps(result, indent=2, ensure_ascii=False).encode('utf8')
+        return json.dumps(result, ensure_ascii=False, separators=(',', ':')).encode('utf8')
+    if fmt == 'msgpack':
+        return packb(result)
+    return (result or '').encode('utf8')
+
+
+def validate_transcriber(transcriber, samples=200):
+    # smoke test of freshly loaded data before it replaces the serving transcriber; raises ValueError
+    if not transcriber.rules:
+        raise ValueError('no transcription rules loaded')
+    words = list(islice(transcriber.exceptions, samples)) + list(transcriber.rule_charset)
+    for word in words:
+        result = transcriber.transcribe(word)
+        if not isinstance(result, str):
+            raise ValueError(f'transcription of {word!r} returned {type(result).__name__}')
+    transcriber.exception_hits = transcriber.rule_fallbacks = 0
+
+
 # based on: https://gist.github.com/2minchul/609255051b7ffcde023be93572b25101
 
 
-def run_server(address, transcriber, cors=True, debug=False):
+def run_server(address, transcriber, cors=True, debug=False, cache_size=1024, max_age=3600,
+               log_level='info', access_log_sample=1.0,
+               max_connections=256, max_inflight=4, max_queue=64, max_body_size=1024*1024, retry_after=1,
+               compress_min_size=1024, compress_level=6, max_header_size=16*1024, max_headers=64,
+               websocket_idle_timeout=300, keepalive_timeout=5, reload=None, admin_token=None, shared_cache=None):
+
+    # reload: callable returning a new transcriber built from current rules and exceptions files,
+    # invoked on SIGHUP or POST /admin/reload (requires `Authorization: Bearer <admin_token>` if admin_token is set,
+    # loopback or unix socket clients only otherwise)
+    # shared_cache: attached to the serving transcriber, on reload only after the new one passed validation
 
     try:
-        from .phonetic_transcriber import clean_text
+        from .phonetic_transcriber import clean_text, jsdict
+        from .metrics import ServerMetrics
+        from .incremental import IncrementalTranscriber
     except ImportError:
-        from phonetic_transcriber import clean_text
-
-    def prep_response(status, headers={}, body=None):
+        from phonetic_transcriber import clean_text, jsdict
+        from metrics import ServerMetrics
+        from incremental import IncrementalTranscriber
+
+    cache = ResponseCache(cache_size) if cache_size > 0 else None
+    limits = ParserLimits(max_header_size=max_header_size, max_headers=max_headers, max_body_size=max_body_size)
+    metrics = ServerMetrics()
+    if shared_cache is not None:
+        transcriber.attach_cache(shared_cache)
+
+    def words_transcribed():
+        return transcriber.exception_hits + transcriber.rule_fallbacks
+
+    # the serving transcriber is replaced by plain rebinding, handlers read it without locking;
+    # concurrent reload triggers share the same pending reload
+    pending_reload = None
+
+    def build_transcriber():
+        new = reload()
+        validate_transcriber(new)
+        if new.rule_stats is not None:
+            # validation words are not traffic
+            new.rule_stats.reset()
+        return new
+
+    async def reload_transcriber():
+        nonlocal transcriber
+        previous = transcriber
+        try:
+            new = await asyncio.get_running_loop().run_in_executor(None, build_transcriber)
+        except Exception as e:
+            metrics.reload_failed()
+            log.exception('Reload failed, keeping data version %s', previous.version)
+            raise HTTPError('500 Internal Server Error', f'reload failed: {e}')
+        # keep counters monotonic across reloads
+        new.exception_hits += previous.exception_hits
+        new.rule_fallbacks += previous.rule_fallbacks
+        # rule counters carry over unless rules changed, counts of a different rule list do not apply
+        if new.rule_stats is not None and previous.rule_stats is not None:
+            if new.rule_list == previous.rule_list:
+                new.rule_stats.merge(previous.rule_stats)
+            else:
+                log.info('Rules changed, rule stats start over')
+        transcriber = new
+        if shared_cache is not None:
+            new.attach_cache(shared_cache)
+        if cache is not None and new.version != previous.version:
+            cache.clear()
+        metrics.reload_succeeded(new.version)
+        log.info('Reloaded transcriber, data version %s -> %s', previous.version, new.version)
+        return jsdict(version=new.version, previous=previous.version)
+
+    def start_reload():
+        nonlocal pending_reload
+        if pending_reload is None:
+            pending_reload = asyncio.ensure_future(reload_transcriber())
+
+            def done(future):
+                nonlocal pending_reload
+                pending_reload = None
+                if not future.cancelled():
+                    future.exception()
+
+            pending_reload.add_done_callback(done)
+        return pending_reload
+
+    # admission control: transcriptions run in a bounded thread pool so the event loop stays responsive
+    # and can shed load; at most max_inflight run at once and at most max_queue wait for a slot
+    executor = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix='transcriber')
+    transcription_slots = None
+    queued = 0
+    active_connections = 0
+
+    async def run_transcription(func, *args, **kwargs):
+        nonlocal queued
+        if transcription_slots.locked() and queued >= max_queue:
+            raise ServerOverloaded()
+        queued += 1
+        try:
+            await transcription_slots.acquire()
+        finally:
+            queued -= 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, lambda: func(*args, **kwargs))
+        finally:
+            transcription_slots.release()
+
+    def is_local(addr):
+        if addr == 'unix':
+            return True
+        try:
+            ip = ipaddress.ip_address(addr)
+        except ValueError:
+            return False
+        return ip.is_loopback or bool(getattr(ip, 'ipv4_mapped', None) and ip.ipv4_mapped.is_loopback)
+
+    def check_admin(req, request_headers):
+        # without admin_token admin endpoints are restricted to local clients (note: a local reverse proxy is local too)
+        if admin_token:
+            if not hmac.compare_digest(request_headers.get('authorization', ''), f'Bearer {admin_token}'):
+                raise HTTPError('401 Unauthorized', headers={'WWW-Authenticate': 'Bearer'})
+        elif not is_local(req.addr):
+            raise HTTPError('403 Forbidden', 'admin endpoints require --admin-token for non-local clients')
+
+    def prep_response(status, headers, body=None):
         nonlocal hostname
 
         if not body:
@@ -48,227 +384,548 @@ def run_server(address, transcriber, cors=True, debug=False):
         response = []
         response.append(f'HTTP/1.1 {status}')
         headers['Host'] = hostname
-        headers['Content-Length'] = len(body) if body else 0
+        if not status.startswith('1') and not status.startswith('304'):
+            headers['Content-Length'] = len(body) if body else 0
         for key, value in headers.items():
             response.append(f'{key}: {value}')
         response.append('')
         response.append('')
         return '\r\n'.join(response).encode('utf8') + body
 
-    def write_response(writer, addr, status='200 OK', headers={}, body=None):
-        print(f'{addr} {status}')
+    def write_response(writer, req, status='200 OK', headers=None, body=None):
+        headers = dict(headers) if headers else {}
+        if headers.get('Connection') == 'close':
+            req.keep_alive = False
+        elif not req.keep_alive:
+            headers['Connection'] = 'close'
+        elif req.version < (1, 1):
+            headers['Connection'] = 'keep-alive'
         if cors:
             headers['Access-Control-Allow-Origin'] = '*'
             headers['Access-Control-Allow-Headers'] = '*'
         data = prep_response(status, headers, body)
         writer.write(data)
+        req.status = status.split(' ', 1)[0]
+        req.sent += len(data)
+        if debug:
+            log.debug('Sent to %s data: %r', req.addr, data)
+
+    def write_overloaded(writer, req):
+        write_response(writer, req, '503 Service Unavailable', {'Retry-After': retry_after, 'Connection': 'close'})
+
+    def observe(req):
+        if req.status:
+            metrics.observe_request(req.endpoint, req.status, time.perf_counter() - req.start, req.received, req.sent)
+
+    def log_access(req):
+        if not req.status or access_log_sample <= 0 or not access_log.isEnabledFor(logging.INFO):
+            return
+        if access_log_sample < 1 and random.random() >= access_log_sample:
+            return
+        access_log.info('%s "%s %s" %s %d %.2fms', req.addr, req.method, req.path, req.status, req.sent,
+                        (time.perf_counter() - req.start) * 1000)
+
+    def parse_options(qs, response_fmt):
+        # transcription options from query parameters, shared by HTTP and WebSocket endpoints
+        response_fmt = qs.get('fmt', [response_fmt])[0]
+        if response_fmt is None:
+            raise HTTPError('406 Not Acceptable')
+        if response_fmt not in response_formats:
+            raise HTTPError('400 Bad Request', f'unsupported format {response_fmt}')
+        sep = qs.get('sep', [' '])[0]
+        unknown_sep = qs.get('unknown_sep', qs.get('usep', [sep]))[0]
+        phoneme_sep = qs.get('phoneme_sep', qs.get('psep', [sep]))[0]
+
+        if phoneme_sep == 'json':
+            phoneme_sep = True
+
+        preserve_unknown = True
+        unknown_str = qs.get('unknown', qs.get('u', ['true']))[0]
+        if unknown_str in '1tTyY' or unknown_str.lower() in ('true', 'yes'):
+            preserve_unknown = True
+        elif unknown_str in '0fFnN' or unknown_str.lower() in ('false', 'no'):
+            preserve_unknown = False
+
+        pretty = qs.get('pretty', ['false'])[0].lower() in ('1', 't', 'y', 'true', 'yes')
+
+        if response_fmt == 'text' and phoneme_sep is True:
+            raise HTTPError('400 Bad Request', 'array response type (sep = True) is only supported with json and msgpack result formats')
+
+        return jsdict(fmt=response_fmt, pretty=pretty, phoneme_sep=phoneme_sep, unknown_sep=unknown_sep, preserve_unknown=preserve_unknown)
+
+    def transcribe_words(current, words, sep):
+        return [current.transcribe(word, sep) for word in words]
+
+    def make_cache_key(current, word, text, options):
+        # keys include data version, so entries produced by a transcriber replaced by reload are never served
+        if word:
+            return (current.version, 'word', word, options.fmt, options.pretty, options.phoneme_sep)
+        return (current.version, 'text', text, options.fmt, options.pretty, options.phoneme_sep, options.unknown_sep, options.preserve_unknown)
+
+    async def transcribe_entry(current, cache_key, word, text, options):
+        # serialized result from response cache, or transcribed in the worker pool and cached
+        entry = cache.get(cache_key) if cache is not None else None
+        if entry is not None:
+            return entry
+        if word:
+            if debug:
+                log.debug('Transcribing: %s', word)
+            result = await run_transcription(current.transcribe, word, options.phoneme_sep)
+        else:
+            if debug:
+                log.debug('Transcribing phrase: %s', text)
+            result = await run_transcription(current.transcribeText, text, preserve_unknown=options.preserve_unknown,
+                                             sep=options.phoneme_sep, unknown_sep=options.unknown_sep)
         if debug:
-            print(f'Sent to {addr} data: {data}')
+            log.debug('Got result: %s', result)
+        entry = jsdict(body=serialize_result(result, options.fmt, options.pretty), content_type=response_formats[options.fmt], encoded={})
+        if cache is not None:
+            cache.put(cache_key, entry)
+        return entry
+
+    async def websocket_session(ws, options, req):
+        # every text message is a word or text fragment, answered with its transcription in the format chosen at handshake
+        opcode = OP_BINARY if options.fmt == 'msgpack' else OP_TEXT
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(ws.receive(), websocket_idle_timeout)
+                except asyncio.TimeoutError:
+                    await ws.close(CLOSE_GOING_AWAY, 'idle timeout')
+                    break
+                if message is None:
+                    break
+                if type(message) is not str:
+                    await ws.close(CLOSE_UNSUPPORTED_DATA, 'only text messages are supported')
+                    break
+                req.received += len(message)
+                text = clean_text(message).strip()
+                current = transcriber
+                entry = await transcribe_entry(current, make_cache_key(current, None, text, options), None, text, options)
+                await ws.send_frame(opcode, entry.body)
+                req.sent += len(entry.body)
+        except WebSocketError as e:
+            log.debug('%s websocket error: %s', req.addr, e)
+            await ws.close(e.code, e.reason)
+        except ServerOverloaded:
+            await ws.close(CLOSE_TRY_AGAIN_LATER)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception:
+            log.exception('%s websocket session failed', req.addr)
+            await ws.close(CLOSE_INTERNAL_ERROR)
+
+    async def document_session(ws, options, req, full=False):
+        # keeps transcription of one edited document; every message is json object, either {"text": ...} with new
+        # version of the document or {"start": ..., "end": ..., "text": ...} replacing characters [start, end);
+        # answered with {"version": ..., "changes": [{"start": ..., "end": ..., "paragraphs": [...]}]}
+        # listing replaced paragraph ranges of the previous version, plus whole "result" if full is set
+        fmt = 'msgpack' if options.fmt == 'msgpack' else 'json'
+        opcode = OP_BINARY if fmt == 'msgpack' else OP_TEXT
+        document = IncrementalTranscriber(transcriber, preserve_unknown=options.preserve_unknown, sep=options.phoneme_sep,
+                                          unknown_sep=options.unknown_sep, preprocess=clean_text)
+
+        def update(message):
+            changes = []
+            if document.transcriber is not transcriber:
+                # rules or exceptions were reloaded, previous transcriptions are stale
+                changes += document.reset(transcriber)
+            if 'start' in message:
+                changes += document.apply(message['start'], message.get('end', message['start']), message['text'])
+            else:
+                changes += document.update(message['text'])
+            response = jsdict(version=document.version, changes=changes)
+            if full:
+                response.result = document.result
+            return response
+
+        try:
+            while True:
+                try:
+                    message = await asyncio.wait_for(ws.receive(), websocket_idle_timeout)
+                except asyncio.TimeoutError:
+                    await ws.close(CLOSE_GOING_AWAY, 'idle timeout')
+                    break
+                if message is None:
+                    break
+                if type(message) is not str:
+                    await ws.close(CLOSE_UNSUPPORTED_DATA, 'only text messages are supported')
+                    break
+                req.received += len(message)
+                try:
+                    message = json.loads(message)
+                    if type(message) is not dict or type(message.get('text')) is not str:
+                        raise ValueError('text missing')
+                    response = await run_transcription(update, message)
+                except (ValueError, TypeError) as e:
+                    await ws.close(CLOSE_INVALID_DATA, str(e)[:100])
+                    break
+                body = serialize_result(response, fmt, options.pretty)
+                await ws.send_frame(opcode, body)
+                req.sent += len(body)
+        except WebSocketError as e:
+            log.debug('%s websocket error: %s', req.addr, e)
+            await ws.close(e.code, e.reason)
+        except ServerOverloaded:
+            await ws.close(CLOSE_TRY_AGAIN_LATER)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception:
+            log.exception('%s websocket session failed', req.addr)
+            await ws.close(CLOSE_INTERNAL_ERROR)
+
+    async def write_entry(writer, req, request, entry, headers, etag=None):
+        # sends serialized result, compressed if it is large enough and client accepts it
+        response_body = entry.body
+        encoding = 'identity'
+        if len(entry.body) >= compress_min_size:
+            encoding = negotiate_encoding(request.headers.get('accept-encoding', 'identity'))
+        if encoding != 'identity':
+            response_body = entry.encoded.get(encoding)
+            if response_body is None:
+                if len(entry.body) > 64*1024:
+                    response_body = await asyncio.get_running_loop().run_in_executor(executor, compress, entry.body, encoding, compress_level)
+                else:
+                    response_body = compress(entry.body, encoding, compress_level)
+                # compressed variants are kept with the cached entry
+                entry.encoded[encoding] = response_body
+            headers['Content-Encoding'] = encoding
+
+        if etag:
+            headers['ETag'] = encoded_etag(etag, encoding)
+        headers['Content-Type'] = entry.content_type
+        write_response(writer, req, '200 OK', headers, body=response_body)
+
+    async def handle_request(reader, writer, req, request):
+        # handles one request; returns a coroutine function when the connection was upgraded to WebSocket
+        # the request is served by transcriber current at its start, even if a reload swaps it meanwhile
+        current = transcriber
+        try:
+            method, path = request.method, request.path
+            req.method, req.path = method, request.target
+            request_headers = request.headers
+
+            if debug:
+                log.debug('Received %s %s %r %r from %s', method, request.target, request_headers, request.body, req.addr)
+
+            if path in ('/healthz', '/metrics'):
+                req.endpoint = path
+                if method != 'GET':
+                    write_response(writer, req, '405 Method Not Allowed', {'Allow': 'GET'})
+                elif path == '/healthz':
+                    write_response(writer, req, '200 OK', {'Content-Type': 'text/plain; charset=utf-8', 'Cache-Control': 'no-store'}, body='ok\n')
+                else:
+                    write_response(writer, req, '200 OK', {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8', 'Cache-Control': 'no-store'},
+                                   body=metrics.render(current, cache))
+                return
+
+            if path == '/admin/reload':
+                req.endpoint = path
+                if reload is None:
+                    raise HTTPError('404 Not Found')
+                if method != 'POST':
+                    raise HTTPError('405 Method Not Allowed', headers={'Allow': 'POST'})
+                check_admin(req, request_headers)
+                result = await asyncio.shield(start_reload())
+                write_response(writer, req, '200 OK', {'Content-Type': 'application/json', 'Cache-Control': 'no-store'},
+                               body=json.dumps(result))
+                return
+
+            if path == '/admin/rules':
+                # per rule counters, collected if transcriber has rule stats enabled
+                req.endpoint = path
+                if current.rule_stats is None:
+                    raise HTTPError('404 Not Found')
+                if method != 'GET':
+                    raise HTTPError('405 Method Not Allowed', headers={'Allow': 'GET'})
+                check_admin(req, request_headers)
+                qs = request.query
+                sort = qs.get('sort', ['time'])[0]
+                if sort not in ('time', 'attempts', 'matches', 'failures', 'index'):
+                    raise HTTPError('400 Bad Request', f'unsupported sort key {sort}')
+                top = qs.get('top', [''])[0]
+                result = jsdict(summary=current.rule_stats.summary(),
+                                rules=current.rule_stats.report(sort=sort, top=int(top) if top.isdigit() else None))
+                write_response(writer, req, '200 OK', {'Content-Type': 'application/json', 'Cache-Control': 'no-store'},
+                               body=json.dumps(result, ensure_ascii=False))
+                return
+
+            if path in ('/transcribe/stream', '/transcribe/document'):
+                req.endpoint = path
+                if method != 'GET' or not is_upgrade_request(request_headers):
+                    write_response(writer, req, '426 Upgrade Required', {'Upgrade': 'websocket', 'Connection': 'Upgrade'})
+                    return
+                headers = handshake_headers(request_headers)
+                if headers is None:
+                    write_response(writer, req, '400 Bad Request')
+                    return
+                options = parse_options(request.query, negotiate_format(request_headers.get('accept', '*/*')))
+                req.keep_alive = True
+                write_response(writer, req, '101 Switching Protocols', headers)
+                req.keep_alive = False
+                ws = WebSocket(reader, writer, max_message_size=max_body_size)
+                if path == '/transcribe/document':
+                    full = request.query.get('full', ['false'])[0].lower() in ('1', 'true', 'yes')
+                    return lambda: document_session(ws, options, req, full)
+                return lambda: websocket_session(ws, options, req)
+
+            if path != '/transcribe':
+                write_response(writer, req, '404 Not Found')
+                return
+
+            req.endpoint = '/transcribe'
+
+            if not (method in ('GET', 'POST', 'OPTIONS') and request.query_string) and method != 'POST':
+                write_response(writer, req, '400 Bad Request')
+                return
+
+            if method == 'OPTIONS':
+                write_response(writer, req, '200 OK')
+                return
+
+            body = request.body
+            words = None
+
+            body_encoding = request_headers.get('content-encoding', 'identity').strip().lower()
+            if body and body_encoding != 'identity':
+                try:
+                    body = decompress(body, body_encoding, max_body_size)
+                except ValueError:
+                    write_response(writer, req, '413 Payload Too Large', {'Connection': 'close'})
+                    return
+                except zlib.error:
+                    write_response(writer, req, '400 Bad Request')
+                    return
+
+            if method == 'POST':
+                mime_type, content_type_params = parse_content_type(request_headers.get('content-type', 'text/plain'))
+                content_charset = content_type_params.get('charset', 'utf-8')
+                if content_charset.lower() not in ('utf-8', 'utf8'):
+                    log.debug('charset %s is not supported', content_charset)
+                    write_response(writer, req, '400 Bad Request')
+                    return
+                if mime_type in ('text', 'text/plain'):
+                    text = body.decode('utf8')
+                elif mime_type == 'application/json':
+                    try:
+                        body = json.loads(body.decode('utf8'))
+                    except (UnicodeDecodeError, json.JSONDecodeError):
+                        write_response(writer, req, '400 Bad Request')
+                        return
+                    if type(body) is not dict:
+                        write_response(writer, req, '400 Bad Request')
+                        return
+                    text = body.get('text')
+                    words = body.get('words')
+                    if text is not None and type(text) is not str:
+                        write_response(writer, req, '400 Bad Request')
+                        return
+                    if words is not None and not (type(words) is list and all(type(word) is str for word in words)):
+                        write_response(writer, req, '400 Bad Request')
+                        return
+                else:
+                    log.debug('MIME type %s is not supported', mime_type)
+                    write_response(writer, req, '400 Bad Request')
+                    return
+            else:
+                text = None
+
+            qs = request.query
+
+            if words is not None:
+                # batch of words, transcribed in one worker call and not cached as a whole
+                options = parse_options(qs, negotiate_format(request_headers.get('accept', '*/*')))
+                try:
+                    result = await run_transcription(transcribe_words, current, [clean_text(word) for word in words], options.phoneme_sep)
+                except ServerOverloaded:
+                    write_overloaded(writer, req)
+                    return
+                if options.fmt == 'text':
+                    result = '\n'.join(r or '' for r in result)
+                entry = jsdict(body=serialize_result(result, options.fmt, options.pretty), content_type=response_formats[options.fmt], encoded={})
+                await write_entry(writer, req, request, entry, {'Vary': 'Accept, Accept-Encoding'})
+                return
+
+            if not qs.get('text') and not text and not qs.get('word'):
+                write_response(writer, req, '400 Bad Request')
+                return
+
+            options = parse_options(qs, negotiate_format(request_headers.get('accept', '*/*')))
+
+            word = clean_text(qs.get('word', [''])[0])
+            if text is None:
+                text = clean_text(qs.get('text', [''])[0])
+
+            cache_key = make_cache_key(current, word, text, options)
+
+            headers = {'Vary': 'Accept, Accept-Encoding'}
+            etag = None
+            if method == 'GET':
+                etag = make_etag(current.version, cache_key)
+                headers['Cache-Control'] = f'public, max-age={max_age}'
+                if_none_match = request_headers.get('if-none-match')
+                matched_etag = matching_etag(etag, if_none_match) if if_none_match else None
+                if matched_etag:
+                    headers['ETag'] = matched_etag
+                    write_response(writer, req, '304 Not Modified', headers)
+                    return
+
+            try:
+                entry = await transcribe_entry(current, cache_key, word, text, options)
+            except ServerOverloaded:
+                write_overloaded(writer, req)
+                return
+            except Exception:
+                log.exception('Transcription failed')
+                # write_response(writer, req, '400 Bad Request')
+                write_response(writer, req, '500 Internal Server Error')
+                return
+
+            await write_entry(writer, req, request, entry, headers, etag)
+
+        except HTTPError as e:
+            log.debug('%s invalid request: %s', req.addr, e)
+            write_response(writer, req, e.status, e.headers)
+        except Exception:
+            log.exception('%s request handling failed', req.addr)
+            write_response(writer, req, '500 Internal Server Error')
 
     async def main_handler(reader: StreamReader, writer: StreamWriter, timeout=30):
         async def session():
-            addr = ''
+            nonlocal active_connections
+            metrics.connection_opened()
+            active_connections += 1
+            addr = writer.get_extra_info('peername')
+            addr = addr[0] if type(addr) is tuple else addr or 'unix'
+            first = True
             try:
-                async with async_timeout(30):
-                    with closing(writer):
+                with closing(writer):
+                    if active_connections > max_connections:
+                        # refused before reading anything, the request (and its body) is never buffered
+                        req = jsdict(addr=addr, method='-', path='-', endpoint='other', status=None, received=0, sent=0,
+                                     version=(1, 1), keep_alive=False, start=time.perf_counter())
+                        write_overloaded(writer, req)
+                        await writer.drain()
+                        observe(req)
+                        log_access(req)
+                        return
+                    # persistent connection: requests are served in sequence until either side closes it
+                    # or no new request arrives within keepalive_timeout
+                    while True:
+                        req = jsdict(addr=addr, method='-', path='-', endpoint='other', status=None, received=0, sent=0,
+                                     version=(1, 0), keep_alive=False, start=time.perf_counter())
+                        upgraded = None
                         try:
-                            data = await reader.readuntil(b'\r\n\r\n')
-                            addr = writer.get_extra_info('peername')
-
-                            if debug:
-                                print(f'Received {data} from {addr!r}')
-
-                            request = data.decode('utf8').split('\r\n')
-
-                            m = re.match(r'([A-Z]+) ([^\s]+) HTTP\/[.0-9]+', request[0])
-                            if not m:
-                                print(f'Invalid request received {data} from {addr!r}')
-                                return
-
-                            method, path = m.groups()
-
-                            print(f'{addr!r} {method} {path}')
-
-                            headers = {}
-                            for line in request[1:]:
-                                m = re.match(r'([^:]+): ([^\r\n]+)', line)
-                                if m:
-                                    key, value = m.groups()
-                                    headers[key.lower()] = value    # we do not process recurring headers
-
-                            if not (path.startswith('/transcribe?') or path == '/transcribe'):
-                                write_response(writer, addr, '404 Not Found')
-                                return
-
-                            if not (method in ('GET', 'POST', 'OPTIONS') and path.startswith('/transcribe?')) and not (method == 'POST' and path == '/transcribe'):
-                                write_response(writer, addr, '400 Bad Request')
-                                return
-
-                            if method == 'OPTIONS':
-                                write_response(writer, addr, '200 OK')
-                                return
-
-                            body = int(headers.get('content-length', 0))
-
-                            if body > 0:
-                                body = await reader.read(body)
-
-                            accepted_fmts = set()
-
-                            # accepts = []
-                            for accept in headers.get('accept', '*/*').split(','):
-                                mime_type, *q = accept.strip().split(';')
-                                if len(q) and q[0].startswith('q='):
-                                    q = float(q[0].split('=')[1])
-                                else:
-                                    q = 1.0
-                                # accepts.append(dict(mime_type=mime_type, q=q))
-                                if mime_type == '*/*':
-                                    accepted_fmts = set(['text', 'json'])
-                                elif mime_type == 'application/json':
-                                    accepted_fmts |= set(['json'])
-                                elif mime_type == 'text/plain':
-                                    accepted_fmts |= set(['text'])
-
-                            accepted_fmts = set(['text', 'json'])
-
-                            if 'text' in accepted_fmts:
-                                response_fmt = 'text'
-                            else:
-                                response_fmt = list(accepted_fmts)[0]
-
-                            if method == 'POST':
-                                content_type = headers.get('content-type', 'text/plain')
-                                mime_type, *content_type_params = content_type.split(';')
-                                try:
-                                    content_type_params = {key:value for key, value in (kv.split('=') for kv in content_type_params)}
-                                except:
-                                    write_response(writer, addr, '400 Bad Request')
-                                    return
-                                content_charset = content_type_params.get('charset', 'utf-8')
-                                if content_charset.lower() != 'utf-8':
-                                    print(f'charset {content_charset} is not  supported')
-                                    write_response(writer, addr, '400 Bad Request')
-                                    return
-                                if mime_type in ('text', 'text/plain'):
-                                    text = body.decode('utf8')
-                                elif mime_type == 'application/json':
-                                    body = body.decode('utf8')
-                                    body = json.loads(body)
-                                    text = body.get('text')
-                                else:
-                                    print(f'MIME type {mime_type} is not  supported')
-                                    write_response(writer, addr, '400 Bad Request')
-                                    return
-                            else:
-                                text = None
-
-                            qs = parse_qs(path.split('?', 1)[1], True)
-
-                            if not qs.get('text') and not text and not qs.get('word'):
-                                write_response(writer, addr, '400 Bad Request')
-                                return
-
-                            response_fmt = qs.get('fmt', [response_fmt])[0]
-                            sep = qs.get('sep', [' '])[0]
-                            unknown_sep = qs.get('unknown_sep', qs.get('usep', [sep]))[0]
-                            phoneme_sep = qs.get('phoneme_sep', qs.get('psep', [sep]))[0]
-
-                            if phoneme_sep == 'json' and 'json' in accepted_fmts:
-                                phoneme_sep = True
-
-                            preserve_unknown = True
-                            unknown_str = qs.get('unknown', qs.get('u', ['true']))[0]
-                            if unknown_str in '1tTyY' or unknown_str.lower() in ('true', 'yes'):
-                                preserve_unknown = True
-                            elif unknown_str in '0fFnN' or unknown_str.lower() in ('false', 'no'):
-                                preserve_unknown = False
-
-                            if response_fmt != 'json' and phoneme_sep is True:
-                                print(f'error: array response type (sep = True) is only supported with json result format', file=sys.stderr)
-                                write_response(writer, addr, '400 Bad Request')
-                                return
-
-
-                            word = clean_text(qs.get('word', [''])[0])
-                            if text is None:
-                                text = clean_text(qs.get('text', [''])[0])
-
                             try:
-                                if word:
-                                    print(f'Transcribing: {word}')
-                                    result = transcriber.transcribe(word, phoneme_sep)
-                                elif text:
-                                    print(f'Transcribing phrase: {text}')
-                                    result = transcriber.transcribeText(text, preserve_unknown=preserve_unknown, sep=phoneme_sep, unknown_sep=unknown_sep)
-                            except Exception as e:
-                                print(traceback.format_exc())
-                                print(f'Got exception: {e}')
-                                # write_response(writer, addr, '400 Bad Request')
-                                write_response(writer, addr, '500 Internal Server Error')
-                                return
-
-                            if response_fmt == 'json':
-                                result = json.dumps(result, indent=2, ensure_ascii=False)
-                                content_type = 'application/json; charset=utf-8'
-                            elif response_fmt == 'text':
-                                content_type = 'text/plain; charset=utf-8'
-
-
-                            print(f'Got result: {result}')
-                            # print(result.encode('utf8'))
-
-                            write_response(writer, addr, '200 OK', {'Content-Type': content_type}, body=result)
-
-                            # writer.write(b'HTTP/1.1 200 OK\r\n')
-                            # writer.write(b'Host: localhost\r\n')
-                            # writer.write(b'Content-Length: 2\r\n')
-                            # writer.write(b'\r\n')
-                            # writer.write(b'OK')
-
-                        except Exception as e:
-                            print(traceback.format_exc())
-                            print(f'{addr} Exception:', e)
-                            write_response(writer, addr, '500 Internal Server Error')
-
-            except asyncio.TimeoutError:
-                print(f'Timeout {addr}')
+                                request = await asyncio.wait_for(read_request(reader, limits), timeout if first else keepalive_timeout)
+                            except asyncio.TimeoutError:
+                                if first:
+                                    log.info('Timeout %s', addr)
+                                break
+                            except HTTPError as e:
+                                log.debug('%s invalid request: %s', addr, e)
+                                write_response(writer, req, e.status, {'Connection': 'close', **e.headers})
+                                break
+                            except (asyncio.IncompleteReadError, ConnectionError):
+                                log.info('%s closed connection before sending full request', addr)
+                                break
+                            if request is None:
+                                break
+                            first = False
+                            req.start = time.perf_counter()
+                            req.received = request.head_size + len(request.body)
+                            req.version = request.version
+                            req.keep_alive = request.keep_alive and keepalive_timeout > 0
+                            try:
+                                async with async_timeout(timeout):
+                                    upgraded = await handle_request(reader, writer, req, request)
+                                    await writer.drain()
+                            except asyncio.TimeoutError:
+                                log.info('Timeout %s', addr)
+                                break
+                            if upgraded:
+                                # upgraded connections are long lived and are not bound by request timeout
+                                await upgraded()
+                                break
+                        finally:
+                            observe(req)
+                            log_access(req)
+                        if not req.keep_alive:
+                            break
+            except ConnectionError:
+                pass
             finally:
-                print(f'Closed connection {addr}')
+                active_connections -= 1
+                metrics.connection_closed()
+                if debug:
+                    log.debug('Closed connection %s', addr)
 
         asyncio.create_task(session())
 
     hostname = ''
 
-    async def main():
-
-        nonlocal hostname
+    async def sample_metrics():
+        while True:
+            metrics.sample_words(words_transcribed())
+            await asyncio.sleep(1)
 
-        host, *port = address.split(':', 2)
-        if len(port) > 0:
-            port = int(port[0])
-        else:
-            port = 8080
-        if not host:
-            host = '127.0.0.1'
-        elif host == '*':
-            host = '0.0.0.0'
+    async def main():
 
-        # host, port = '127.0.0.1', 8888
+        nonlocal hostname, transcription_slots
 
-        server = await asyncio.start_server(
-            main_handler, host, port
-        )
-        addr = server.sockets[0].getsockname()
-        print(f'Serving on {addr}')
+        transcription_slots = asyncio.Semaphore(max_inflight)
+        asyncio.create_task(sample_metrics())
+        metrics.data_version = transcriber.version
 
-        hostname = ':'.join(map(str, addr[:2]))
+        if reload is not None:
+            try:
+                asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, start_reload)
+            except (NotImplementedError, AttributeError):
+                # no SIGHUP on windows, admin endpoint only
+                pass
+
+        if address.startswith('unix:'):
+            path = address[5:]
+            if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+                # stale socket left by previous run
+                os.unlink(path)
+            server = await asyncio.start_unix_server(
+                main_handler, path, limit=max(max_header_size, 64*1024)
+            )
+            log.info('Serving on %s', address)
+            hostname = 'localhost'
+        else:
+            host, *port = address.split(':', 2)
+            if len(port) > 0:
+                port = int(port[0])
+            else:
+                port = 8080
+            if not host:
+                host = '127.0.0.1'
+            elif host == '*':
+                host = '0.0.0.0'
+
+            # host, port = '127.0.0.1', 8888
+
+            server = await asyncio.start_server(
+                main_handler, host, port, limit=max(max_header_size, 64*1024)
+            )
+            addr = server.sockets[0].getsockname()
+            log.info('Serving on %s', addr)
+
+            hostname = ':'.join(map(str, addr[:2]))
 
         async with server:
             await server.serve_forever()
 
 
-    asyncio.run(main())
+    listener = setup_logging('debug' if debug else log_level)
+    try:
+        asyncio.run(main())
+    finally:
+        executor.shutdown(wait=False)
+        if listener:
+            listener.stop()
 
 
 if __name__ == '__main__':
@@ -278,11 +935,46 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--rules', '-r', metavar='FILE', type=str, help='input rules.json')
     parser.add_argument('--exceptdb', '-e', metavar='FILE', type=str, help='input exceptions.json')
-    parser.add_argument('--server', '-s', metavar='HOST:PORT', default='localhost:8080', help='run server listening on [HOST]:PORT')
-    parser.add_argument('--debug', '-d', action='store_true', help='debug mode')
+    parser.add_argument('--server', '-s', metavar='HOST:PORT', default='localhost:8080', help='run server listening on [HOST]:PORT or unix:PATH')
+    parser.add_argument('--keepalive-timeout', metavar='SECONDS', type=float, default=5, help='close idle persistent connections after this long, 0 to disable keep-alive')
+    parser.add_argument('--debug', '-d', action='store_true', help='debug mode, logs full request and response payloads')
+    parser.add_argument('--log-level', metavar='LEVEL', type=str, default='info', help='log level: debug, info, warning, error')
+    parser.add_argument('--access-log-sample', metavar='RATE', type=float, default=1.0, help='fraction of requests written to access log, 0 to disable')
+    parser.add_argument('--cache-size', metavar='N', type=int, default=1024, help='number of responses kept in LRU response cache, 0 to disable')
+    parser.add_argument('--max-age', metavar='SECONDS', type=int, default=3600, help='Cache-Control max-age for GET responses')
+    parser.add_argument('--max-connections', metavar='N', type=int, default=256, help='concurrent connections before new ones are rejected with 503')
+    parser.add_argument('--max-inflight', metavar='N', type=int, default=4, help='transcriptions running at once')
+    parser.add_argument('--max-queue', metavar='N', type=int, default=64, help='requests waiting for a transcription slot before new ones are rejected with 503')
+    parser.add_argument('--max-body-size', metavar='BYTES', type=int, default=1024*1024, help='maximum request body size')
+    parser.add_argument('--max-header-size', metavar='BYTES', type=int, default=16*1024, help='maximum size of request line and headers')
+    parser.add_argument('--max-headers', metavar='N', type=int, default=64, help='maximum number of request headers')
+    parser.add_argument('--websocket-idle-timeout', metavar='SECONDS', type=float, default=300, help='close /transcribe/stream sessions idle for this long')
+    parser.add_argument('--compress-min-size', metavar='BYTES', type=int, default=1024, help='compress responses of at least this size if client accepts gzip or deflate')
+    parser.add_argument('--shared-cache', metavar='NAME', type=str, help='cache words transcribed by rules in shared memory segment NAME, shared with other workers')
+    parser.add_argument('--shared-cache-slots', metavar='N', type=int, default=65536, help='entries in shared memory cache when it is created')
+    parser.add_argument('--rule-stats', action='store_true', help='collect per rule counters, served at GET /admin/rules; disables response cache and bypasses shared cache so every word is counted')
+    parser.add_argument('--shadow-rules', metavar='FILE', type=str, help='shadow mode: compare sampled transcriptions with engine using these rules')
+    parser.add_argument('--shadow-engine', metavar='MODULE:FACTORY', type=str, help='shadow mode: compare sampled transcriptions with this engine')
+    parser.add_argument('--shadow-rate', metavar='RATE', type=float, default=0.01, help='fraction of transcriptions compared in shadow mode')
+    parser.add_argument('--admin-token', metavar='TOKEN', type=str, help='bearer token required by admin endpoints, without it they are served to loopback and unix socket clients only')
+    parser.add_argument('--compress-level', metavar='LEVEL', type=int, default=6, help='gzip/deflate compression level, 1-9')
+    parser.add_argument('--profile-startup', action='store_true', help='print time of loading phases and memory held by loaded data')
+    parser.add_argument('--cprofile', metavar='FILE', type=str, help='profile main thread (startup and event loop) with cProfile, write pstats to FILE on SIGUSR1 and at exit')
+    parser.add_argument('--tracemalloc', metavar='FILE', type=str, help='trace allocations, write tracemalloc snapshot to FILE on SIGUSR1 and at exit')
 
     args = parser.parse_args()
 
+    if args.cprofile or args.tracemalloc:
+        import atexit
+        try:
+            from .startup_stats import Profiling
+        except ImportError:
+            from startup_stats import Profiling
+        profiling = Profiling(args.cprofile, args.tracemalloc)
+        atexit.register(profiling.stop)
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: profiling.dump())
+
     try:
         from .phonetic_transcriber import PhoneticTranscriberData, default_rules_path, default_exceptions_path, PhoneticTranscriber
         from .phonetic_converter import IPACharacterConverter
@@ -290,8 +982,47 @@ if __name__ == '__main__':
         from phonetic_transcriber import PhoneticTranscriberData, default_rules_path, default_exceptions_path, PhoneticTranscriber
         from phonetic_converter import IPACharacterConverter
 
-    data = PhoneticTranscriberData(rules_filepath=args.rules or default_rules_path, exceptions_filepath=args.exceptdb or default_exceptions_path)
-
-    transcriber = PhoneticTranscriber(sep=' ', encoder=IPACharacterConverter(), data=data)
-
-    run_server(args.server, transcriber, debug=args.debug)
+    shared_cache = None
+    if args.shared_cache:
+        try:
+            from .shared_cache import SharedTranscriptionCache
+        except ImportError:
+            from shared_cache import SharedTranscriptionCache
+        shared_cache = SharedTranscriptionCache(args.shared_cache, slots=args.shared_cache_slots)
+
+    def load_transcriber():
+        data = PhoneticTranscriberData(rules_filepath=args.rules or default_rules_path, exceptions_filepath=args.exceptdb or default_exceptions_path)
+        transcriber = PhoneticTranscriber(sep=' ', encoder=IPACharacterConverter(), data=data)
+        if args.rule_stats:
+            transcriber.enable_rule_stats()
+        if args.shadow_rules or args.shadow_engine:
+            # responses always come from the reference transcriber, mismatches are logged and counted in metrics
+            try:
+                from .differential import ShadowTranscriber, load_engine
+            except ImportError:
+                from differential import ShadowTranscriber, load_engine
+            shadow_data = PhoneticTranscriberData(rules_filepath=args.shadow_rules or args.rules or default_rules_path,
+                                                  exceptions_filepath=args.exceptdb or default_exceptions_path)
+            if args.shadow_engine:
+                candidate = load_engine(args.shadow_engine, shadow_data, sep=' ', encoder=IPACharacterConverter())
+            else:
+                candidate = PhoneticTranscriber(sep=' ', encoder=IPACharacterConverter(), data=shadow_data)
+            transcriber = ShadowTranscriber(transcriber, candidate, rate=args.shadow_rate)
+        return transcriber
+
+    transcriber = load_transcriber()
+
+    if args.profile_startup:
+        try:
+            from .startup_stats import format_stats
+        except ImportError:
+            from startup_stats import format_stats
+        print(format_stats(transcriber.stats()), file=sys.stderr)
+
+    run_server(args.server, transcriber, debug=args.debug, cache_size=0 if args.rule_stats else args.cache_size, max_age=args.max_age,
+               log_level=args.log_level, access_log_sample=args.access_log_sample,
+               max_connections=args.max_connections, max_inflight=args.max_inflight, max_queue=args.max_queue,
+               max_body_size=args.max_body_size, compress_min_size=args.compress_min_size, compress_level=args.compress_level,
+               max_header_size=args.max_header_size, max_headers=args.max_headers, websocket_idle_timeout=args.websocket_idle_timeout,
+               keepalive_timeout=args.keepalive_timeout, reload=load_transcriber, admin_token=args.admin_token,
+               shared_cache=shared_cache)
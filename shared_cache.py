@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+import os, struct, hashlib, tempfile, threading
+from multiprocessing import shared_memory
+
+try:
+    import fcntl
+except ImportError:
+    # no cross process writer lock on this platform, cache is then only safe within a single process
+    fcntl = None
+
+
+# Transcription cache in shared memory, shared by all worker processes on a node.
+#
+# Fixed size open addressing hash table of word -> phonemes. Every slot holds one entry, a word is stored in one of
+# `probes` consecutive slots starting at its hash. When all of them are taken, the victim is chosen by clock
+# (second chance): slots whose reference bit is set get it cleared and are skipped. Entries that do not fit
+# in a slot are not cached.
+#
+# Writers are serialized by fcntl lock on a lock file. Readers take no lock; every slot has a sequence counter
+# (seqlock) that writers make odd while the slot is being modified, a read that sees an odd or changed counter
+# is treated as a miss. Header carries the tag of data version the entries were produced from, see bind().
+
+MAGIC = b'PTSC'
+LAYOUT_VERSION = 1
+HEADER = struct.Struct('<4sIIIIQ48s')    # magic, layout version, slots, slot size, probes, data tag, data version
+HEADER_SIZE = 128
+SLOT_HEAD = struct.Struct('<IQHHB')      # seq, hash, key length, value length, reference bit
+SEQ = struct.Struct('<I')
+HASH = struct.Struct('<Q')
+TAG_OFFSET = 20
+REF_OFFSET = SLOT_HEAD.size - 1
+
+
+def stable_hash(data):
+    # must be equal in all processes, so builtin hash() can not be used; 0 marks empty slot
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little') or 1
+
+
+class SharedTranscriptionCache:
+
+    def __init__(self, name='phonetic-transcriber', slots=65536, slot_size=128, probes=8):
+        # attaches to existing cache of given name or creates it; size arguments only apply when it is created
+        self.name = name
+        self.lock_path = os.path.join(tempfile.gettempdir(), f'{name}.lock')
+        self.thread_lock = threading.Lock()
+        self.lock_file = open(self.lock_path, 'a+b')
+        self.hits = 0
+        self.misses = 0
+        with self.locked():
+            self.shm, self.created, self.untracked = open_segment(name, HEADER_SIZE + slots * slot_size)
+            if self.created:
+                HEADER.pack_into(self.shm.buf, 0, MAGIC, LAYOUT_VERSION, slots, slot_size, probes, 0, b'')
+            magic, layout, self.slots, self.slot_size, self.probes, _, _ = HEADER.unpack_from(self.shm.buf, 0)
+        if magic != MAGIC or layout != LAYOUT_VERSION:
+            self.close()
+            raise ValueError(f'shared memory {name} is not a transcription cache of layout version {LAYOUT_VERSION}')
+        self.buf = self.shm.buf
+        self.max_item_size = self.slot_size - SLOT_HEAD.size
+
+    def locked(self):
+        return _Lock(self)
+
+    @property
+    def tag(self):
+        return HASH.unpack_from(self.buf, TAG_OFFSET)[0]
+
+    @property
+    def version(self):
+        return HEADER.unpack_from(self.buf, 0)[6].rstrip(b'\0').decode('ascii', 'replace')
+
+    def bind(self, version):
+        # declares version of the data entries are produced from and returns tag to pass to get() and put();
+        # entries of other version are dropped, lookups and stores with tag of other version miss / are ignored
+        tag = stable_hash(version.encode('utf8'))
+        with self.locked():
+            if self.tag != tag:
+                self.clear_slots()
+                struct.pack_into('<Q48s', self.buf, TAG_OFFSET, tag, version.encode('utf8')[:48])
+        return tag
+
+    def slot_offset(self, index):
+        return HEADER_SIZE + index * self.slot_size
+
+    def get(self, word, tag):
+        buf = self.buf
+        if HASH.unpack_from(buf, TAG_OFFSET)[0] != tag:
+            self.misses += 1
+            return
+        key = word.encode('utf8')
+        h = stable_hash(key)
+        for i in range(self.probes):
+            offset = self.slot_offset((h + i) % self.slots)
+            seq, slot_hash, key_len, value_len, ref = SLOT_HEAD.unpack_from(buf, offset)
+            if not slot_hash:
+                break
+            if slot_hash != h or key_len != len(key) or seq & 1:
+                continue
+            start = offset + SLOT_HEAD.size
+            if buf[start:start + key_len] != key:
+                continue
+            value = bytes(buf[start + key_len:start + key_len + value_len])
+            if SEQ.unpack_from(buf, offset)[0] != seq:
+                # modified while being read
+                break
+            if not ref:
+                buf[offset + REF_OFFSET] = 1
+            try:
+                value = value.decode('utf8')
+            except UnicodeDecodeError:
+                break
+            self.hits += 1
+            return value
+        self.misses += 1
+
+    def put(self, word, value, tag):
+        key = word.encode('utf8')
+        value = value.encode('utf8')
+        if len(key) + len(value) > self.max_item_size:
+            return False
+        h = stable_hash(key)
+        buf = self.buf
+        with self.locked():
+            if self.tag != tag:
+                return False
+            window = [self.slot_offset((h + i) % self.slots) for i in range(self.probes)]
+            target = None
+            for offset in window:
+                _, slot_hash, key_len, _, _ = SLOT_HEAD.unpack_from(buf, offset)
+                if not slot_hash or (slot_hash == h and buf[offset + SLOT_HEAD.size:offset + SLOT_HEAD.size + key_len] == key):
+                    target = offset
+                    break
+            if target is None:
+                # clock: skip recently used slots, clearing their reference bit
+                for offset in window:
+                    if not buf[offset + REF_OFFSET]:
+                        target = offset
+                        break
+                    buf[offset + REF_OFFSET] = 0
+                else:
+                    target = window[0]
+            seq = SEQ.unpack_from(buf, target)[0]
+            SEQ.pack_into(buf, target, (seq + 1) & 0xffffffff)
+            start = target + SLOT_HEAD.size
+            buf[start:start + len(key)] = key
+            buf[start + len(key):start + len(key) + len(value)] = value
+            struct.pack_into('<QHHB', buf, target + SEQ.size, h, len(key), len(value), 1)
+            SEQ.pack_into(buf, target, (seq + 2) & 0xffffffff)
+        return True
+
+    def clear_slots(self):
+        # caller holds the lock; bumping sequence numbers makes concurrent readers discard what they read
+        buf = self.buf
+        for index in range(self.slots):
+            offset = self.slot_offset(index)
+            seq = SEQ.unpack_from(buf, offset)[0]
+            if HASH.unpack_from(buf, offset + SEQ.size)[0]:
+                SEQ.pack_into(buf, offset, (seq + 1) & 0xffffffff)
+                buf[offset + SEQ.size:offset + self.slot_size] = bytes(self.slot_size - SEQ.size)
+                SEQ.pack_into(buf, offset, (seq + 2) & 0xffffffff)
+
+    def clear(self):
+        with self.locked():
+            self.clear_slots()
+
+    def __len__(self):
+        return sum(1 for index in range(self.slots) if HASH.unpack_from(self.buf, self.slot_offset(index) + SEQ.size)[0])
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        self.lock_file.close()
+
+    def unlink(self):
+        # removes the shared memory segment, processes attached to it keep their mapping
+        if self.untracked:
+            # SharedMemory.unlink() unregisters the segment from resource tracker, which fails if not registered
+            from multiprocessing import resource_tracker
+            resource_tracker.register(self.shm._name, 'shared_memory')
+        self.shm.unlink()
+        try:
+            os.unlink(self.lock_path)
+        except OSError:
+            pass
+
+
+class _Lock:
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def __enter__(self):
+        self.cache.thread_lock.acquire()
+        if fcntl:
+            fcntl.flock(self.cache.lock_file.fileno(), fcntl.LOCK_EX)
+
+    def __exit__(self, exc_type, exc, tb):
+        if fcntl:
+            fcntl.flock(self.cache.lock_file.fileno(), fcntl.LOCK_UN)
+        self.cache.thread_lock.release()
+
+
+def open_segment(name, size):
+    # returns (segment, created, untracked); segments stay until unlink(), they are kept out of the resource tracker,
+    # which would remove them when the process that created or attached them exits
+    try:
+        try:
+            return shared_memory.SharedMemory(name, create=True, size=size, track=False), True, False
+        except FileExistsError:
+            return shared_memory.SharedMemory(name, track=False), False, False
+    except TypeError:
+        pass
+    try:
+        shm, created = shared_memory.SharedMemory(name, create=True, size=size), True
+    except FileExistsError:
+        shm, created = shared_memory.SharedMemory(name), False
+    from multiprocessing import resource_tracker
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm, created, True
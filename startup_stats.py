@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import sys, gc, cProfile, tracemalloc
+from types import ModuleType, FunctionType
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    from .phonetic_transcriber import jsdict
+    from . import phonetic_converter
+except ImportError:
+    from phonetic_transcriber import jsdict
+    import phonetic_converter
+
+
+# Startup and memory instrumentation: where loading time goes (PhoneticTranscriberData.timings,
+# PhoneticTranscriber.timings, phonetic_converter.dataset_load_time) and approximate memory held by compiled
+# transcriber state. Profiling runs cProfile and/or tracemalloc from process start and dumps on demand.
+
+
+def deep_sizeof(obj, seen=None):
+    # approximate bytes of obj and everything reachable from it, objects already in seen are not counted again
+    seen = set() if seen is None else seen
+    size = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, (type, ModuleType, FunctionType)):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        stack.extend(gc.get_referents(o))
+    return size
+
+
+def max_rss():
+    # peak resident set size of the process in bytes, None where unsupported
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def transcriber_stats(transcriber, extra_timings=None, extra_objects=None):
+    # extra_timings: name -> seconds and extra_objects: name -> object, for state loaded outside of transcriber
+    # (e.g. phoneme maps); objects shared by several entries are counted in the first one only
+    timings = jsdict(data=jsdict(transcriber.data_timings), converter_dataset=phonetic_converter.dataset_load_time,
+                     transcriber=jsdict(transcriber.timings))
+    timings.update(extra_timings or {})
+    timings.total = sum(value if isinstance(value, (int, float)) else sum(value.values())
+                        for value in timings.values() if value is not None)
+
+    # all groups are kept referenced until measured, ids in seen must not be reused by temporary objects
+    groups = [
+        ('exceptions', transcriber.exceptions),
+        ('rules', transcriber.rule_list),
+        ('rules_index', (transcriber.rules, transcriber.rule_reach)),
+        ('metarules', transcriber.metarules),
+        ('regexes', (transcriber.charset_re, transcriber.not_charset_re)),
+        # loaded once per process, shared by all converters
+        ('converter_tables', phonetic_converter.dataset),
+        ('rule_stats', transcriber.rule_stats),
+    ]
+    groups += list((extra_objects or {}).items())
+    seen = set()
+    memory = jsdict((name, deep_sizeof(obj, seen) if obj is not None else 0) for name, obj in groups)
+    memory.total = sum(memory.values())
+
+    stats = jsdict(timings=timings, memory=memory, rules=len(transcriber.rule_list), exceptions=len(transcriber.exceptions),
+                   max_rss=max_rss())
+    cache = transcriber.cache
+    if cache is not None and getattr(cache, 'shm', None) is not None:
+        # shared memory segment, mapped by every worker, not part of memory total
+        stats.shared_cache = jsdict(size=cache.shm.size, hits=cache.hits, misses=cache.misses)
+    return stats
+
+
+def format_size(size):
+    if size is None:
+        return '-'
+    return f'{size / 1024:.1f} KiB' if size < 1024 * 1024 else f'{size / 1024 / 1024:.1f} MiB'
+
+
+def format_stats(stats):
+    lines = [f'startup {stats.timings.total * 1000:.1f} ms, {stats.rules} rules, {stats.exceptions} exceptions, '
+             f'max rss {format_size(stats.max_rss)}']
+    for phase, value in stats.timings.items():
+        if phase == 'total' or value is None:
+            continue
+        if isinstance(value, dict):
+            for name, seconds in value.items():
+                lines.append(f'  {phase + "." + name:<32} {seconds * 1000:>10.2f} ms')
+        else:
+            lines.append(f'  {phase:<32} {value * 1000:>10.2f} ms')
+    lines.append(f'memory {format_size(stats.memory.total)}')
+    for name, size in stats.memory.items():
+        if name != 'total':
+            lines.append(f'  {name:<32} {format_size(size):>13}')
+    if stats.shared_cache:
+        lines.append(f'  {"shared_cache (shared memory)":<32} {format_size(stats.shared_cache.size):>13}')
+    return '\n'.join(lines)
+
+
+class Profiling:
+
+    # cProfile (thread that created it only) and/or tracemalloc started at construction; dump() writes current
+    # results and can be called repeatedly, e.g. from a signal handler, stop() dumps and stops
+
+    def __init__(self, cprofile_path=None, tracemalloc_path=None, frames=25):
+        self.cprofile_path = cprofile_path
+        self.tracemalloc_path = tracemalloc_path
+        self.profiler = None
+        if cprofile_path:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        if tracemalloc_path and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def dump(self):
+        # pstats file readable by `python -m pstats FILE` and tracemalloc.Snapshot.load(FILE)
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.cprofile_path)
+            self.profiler.enable()
+        if self.tracemalloc_path and tracemalloc.is_tracing():
+            tracemalloc.take_snapshot().dump(self.tracemalloc_path)
+
+    def stop(self):
+        self.dump()
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler = None
+        if self.tracemalloc_path:
+            tracemalloc.stop()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import base64, hashlib, struct
+
+
+# Server side of the WebSocket protocol (RFC 6455) on top of asyncio streams
+
+websocket_guid = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+CLOSE_NORMAL = 1000
+CLOSE_GOING_AWAY = 1001
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_UNSUPPORTED_DATA = 1003
+CLOSE_INVALID_DATA = 1007
+CLOSE_MESSAGE_TOO_BIG = 1009
+CLOSE_INTERNAL_ERROR = 1011
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class WebSocketError(Exception):
+
+    def __init__(self, code, reason=''):
+        super().__init__(reason or str(code))
+        self.code = code
+        self.reason = reason
+
+
+def is_upgrade_request(headers):
+    return headers.get('upgrade', '').lower() == 'websocket' and 'upgrade' in headers.get('connection', '').lower()
+
+
+def accept_key(key):
+    return base64.b64encode(hashlib.sha1(key.strip().encode('ascii') + websocket_guid).digest()).decode('ascii')
+
+
+def handshake_headers(headers):
+    # returns response headers for 101 Switching Protocols, None if the handshake request is invalid
+    key = headers.get('sec-websocket-key')
+    if not key or headers.get('sec-websocket-version') != '13':
+        return
+    try:
+        if len(base64.b64decode(key, validate=True)) != 16:
+            return
+    except ValueError:
+        return
+    return {'Upgrade': 'websocket', 'Connection': 'Upgrade', 'Sec-WebSocket-Accept': accept_key(key)}
+
+
+def encode_frame(opcode, payload, fin=True):
+    # server to client frames are not masked
+    n = len(payload)
+    head = bytes(((0x80 if fin else 0) | opcode,))
+    if n < 126:
+        head += bytes((n,))
+    elif n < 1 << 16:
+        head += b'\x7e' + struct.pack('>H', n)
+    else:
+        head += b'\x7f' + struct.pack('>Q', n)
+    return head + payload
+
+
+def unmask(payload, mask):
+    # xor with the 4 byte key, done on whole integers instead of per byte
+    n = len(payload)
+    key = int.from_bytes((mask * (n // 4 + 1))[:n], 'big')
+    return (int.from_bytes(payload, 'big') ^ key).to_bytes(n, 'big')
+
+
+class WebSocket:
+
+    def __init__(self, reader, writer, max_message_size=1024*1024):
+        self.reader = reader
+        self.writer = writer
+        self.max_message_size = max_message_size
+        self.closed = False
+
+    async def read_frame(self):
+        head = await self.reader.readexactly(2)
+        fin = head[0] & 0x80
+        if head[0] & 0x70:
+            raise WebSocketError(CLOSE_PROTOCOL_ERROR, 'reserved bits set')
+        opcode = head[0] & 0x0f
+        if not head[1] & 0x80:
+            raise WebSocketError(CLOSE_PROTOCOL_ERROR, 'client frames must be masked')
+        n = head[1] & 0x7f
+        if n == 126:
+            n = struct.unpack('>H', await self.reader.readexactly(2))[0]
+        elif n == 127:
+            n = struct.unpack('>Q', await self.reader.readexactly(8))[0]
+        if opcode >= OP_CLOSE and (n > 125 or not fin):
+            raise WebSocketError(CLOSE_PROTOCOL_ERROR, 'invalid control frame')
+        if n > self.max_message_size:
+            raise WebSocketError(CLOSE_MESSAGE_TOO_BIG)
+        mask = await self.reader.readexactly(4)
+        payload = await self.reader.readexactly(n) if n else b''
+        return fin, opcode, unmask(payload, mask) if n else b''
+
+    async def receive(self):
+        # returns next text (str) or binary (bytes) message, None when connection was closed;
+        # control frames are answered here
+        fragments = []
+        message_opcode = None
+        size = 0
+        while True:
+            fin, opcode, payload = await self.read_frame()
+            if opcode == OP_PING:
+                await self.send_frame(OP_PONG, payload)
+                continue
+            if opcode == OP_PONG:
+                continue
+            if opcode == OP_CLOSE:
+                code = struct.unpack('>H', payload[:2])[0] if len(payload) >= 2 else CLOSE_NORMAL
+                await self.close(code)
+                return
+            if opcode == OP_CONTINUATION:
+                if message_opcode is None:
+                    raise WebSocketError(CLOSE_PROTOCOL_ERROR, 'unexpected continuation frame')
+            elif opcode in (OP_TEXT, OP_BINARY):
+                if message_opcode is not None:
+                    raise WebSocketError(CLOSE_PROTOCOL_ERROR, 'expected continuation frame')
+                message_opcode = opcode
+            else:
+                raise WebSocketError(CLOSE_PROTOCOL_ERROR, 'unknown opcode')
+            size += len(payload)
+            if size > self.max_message_size:
+                raise WebSocketError(CLOSE_MESSAGE_TOO_BIG)
+            fragments.append(payload)
+            if fin:
+                break
+        data = b''.join(fragments)
+        if message_opcode == OP_TEXT:
+            try:
+                return data.decode('utf8')
+            except UnicodeDecodeError:
+                raise WebSocketError(CLOSE_INVALID_DATA, 'invalid utf-8')
+        return data
+
+    async def send_frame(self, opcode, payload):
+        self.writer.write(encode_frame(opcode, payload))
+        await self.writer.drain()
+
+    async def send(self, message):
+        if type(message) is str:
+            await self.send_frame(OP_TEXT, message.encode('utf8'))
+        else:
+            await self.send_frame(OP_BINARY, bytes(message))
+
+    async def close(self, code=CLOSE_NORMAL, reason=''):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await self.send_frame(OP_CLOSE, struct.pack('>H', code) + reason.encode('utf8')[:123])
+        except ConnectionError:
+            pass